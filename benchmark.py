@@ -0,0 +1,222 @@
+##############################################################################80
+#                                                                              #
+#                              COVID-19 BENCHMARK                              #
+#                                                                              #
+# (2020) Nicolo Fabbiane                                                       #
+#                                                                              #
+################################################################################
+
+# system
+import os, sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import tracemalloc
+import subprocess
+
+# math
+import numpy as np
+
+# local libraries
+import libpy.rawdata as rd
+from libpy.fitting import fit_logistic
+from libpy.synthetic import write_data
+
+
+
+
+################################################################################
+# Parameters
+#
+# command line__________________________________________________________________
+
+parser = argparse.ArgumentParser(description='COVID-19 statistics benchmark (offline, synthetic data)')
+parser.add_argument('--formats', default='jhu,dpc,ofr',
+                    help='comma-separated data formats: jhu, dpc, ofr, jhu-us, dpc-province '
+                         'or ofr-departement (default: jhu,dpc,ofr)')
+parser.add_argument('--regions', type=int, default=200,
+                    help='number of regions (default: 200)')
+parser.add_argument('--days', type=int, default=300,
+                    help='number of days (default: 300)')
+parser.add_argument('--sparsity', type=float, default=.05,
+                    help='fraction of missing cells/rows (default: 0.05)')
+parser.add_argument('--groups', type=int, default=50,
+                    help='number of aggregated groups of regions (default: 50)')
+parser.add_argument('--group-size', type=int, default=10,
+                    help='number of regions in each group (default: 10)')
+parser.add_argument('--figures', type=int, default=5,
+                    help='number of fitted and rendered figures (default: 5)')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='number of repetitions of each stage, the best is kept (default: 3)')
+parser.add_argument('--stages', default='parse,aggregate,fit,render',
+                    help='comma-separated stages (default: parse,aggregate,fit,render)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the synthetic data (default: 0)')
+parser.add_argument('--output', default=None,
+                    help='write the results to this JSON file')
+args = parser.parse_args()
+
+stages = args.stages.split(',')
+
+
+# common________________________________________________________________________
+
+# number of days in the future (as in visualize.py)
+future = 7
+
+
+
+
+################################################################################
+# Stages
+#
+# measure_______________________________________________________________________
+
+def cpu_time():
+	"""
+	"""
+	# user and system time of this process and of its children
+	return sum(os.times()[:4])
+
+def measure(fun, count, trace=True):
+	"""
+	"""
+	# best wall and CPU time over the repetitions
+	wall = []; cpu = []
+	for _ in range(args.repeat):
+		w0 = time.perf_counter(); c0 = cpu_time()
+		fun()
+		wall.append(time.perf_counter() - w0); cpu.append(cpu_time() - c0)
+	# peak of the allocated memory (separate run, tracing slows down)
+	peak = None
+	if trace:
+		tracemalloc.start()
+		fun()
+		peak = tracemalloc.get_traced_memory()[1]/2.**20
+		tracemalloc.stop()
+	return {'wall'      : min(wall),
+	        'cpu'       : min(cpu),
+	        'count'     : count,
+	        'throughput': count/max(min(wall), 1e-9),
+	        'peak_mb'   : peak}
+
+
+# stages________________________________________________________________________
+
+def parse_stage(path, data_fmt):
+	"""
+	"""
+	rawdata = rd.RawData(path=path, data_fmt=data_fmt, cache=False, offline=True)
+	rawdata.load()
+	return rawdata
+
+def aggregate_stage(rawdata, groups):
+	"""
+	"""
+	# no cached aggregates
+	rawdata.aggregates = {}
+	rawdata.get_data_for_regions(None)
+	for regions in groups: rawdata.get_data_for_regions(regions)
+
+def fit_stage(rawdata, groups):
+	"""
+	"""
+	days = np.array([(t - rawdata.time[-1]).days for t in rawdata.time])
+	for regions in groups:
+		confirmed, recovered, deaths, active, intensive = rawdata.get_data_for_regions(regions)
+		fit_logistic(days, confirmed, deaths, recovered, future=future)
+
+def render_stage(workdir, data_set):
+	"""
+	"""
+	# whole visualize.py run: start-up, read, fit and render (PNG only)
+	main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'visualize.py')
+	env  = dict(os.environ, PYTHONPATH=workdir, PYTHONWARNINGS='ignore')
+	subprocess.run([sys.executable, main, data_set, '--offline', '--force', '--formats', 'png'],
+	               cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+# data-set for visualize.py_____________________________________________________
+
+def write_data_set(workdir, data_set, path, data_fmt, groups):
+	"""
+	"""
+	figures = dict(('Group %02d' %(i), regions) for i, regions in enumerate(groups))
+	with open(os.path.join(workdir, data_set + '.py'), 'w') as f:
+		f.write('raw_data = %r\n' %({'path': path, 'data_fmt': data_fmt}))
+		f.write('figures = %r\n'  %(figures))
+
+
+
+
+################################################################################
+# Benchmark
+#
+# loop__________________________________________________________________________
+
+results = {'parameters': vars(args), 'formats': {}}
+workdir = tempfile.mkdtemp(prefix='covid19-bench-')
+
+try:
+	for data_fmt in args.formats.split(','):
+		result = {}
+
+		# synthetic data
+		path = os.path.join(workdir, data_fmt)
+		w0 = time.perf_counter()
+		write_data(path, data_fmt, args.regions, args.days, args.sparsity, seed=args.seed)
+		result['generate'] = {'wall': time.perf_counter() - w0}
+
+		# random groups of regions
+		rawdata = parse_stage(path, data_fmt)
+		rng = np.random.default_rng(args.seed)
+		size = min(args.group_size, len(rawdata.regions))
+		groups = [sorted(rng.choice(rawdata.regions, size, replace=False).tolist())
+		          for _ in range(args.groups)]
+		cells = rawdata.data.size # stored cells (regions x days x metrics read)
+
+		# stages
+		if 'parse' in stages:
+			result['parse'] = measure(lambda: parse_stage(path, data_fmt), cells)
+		if 'aggregate' in stages:
+			result['aggregate'] = measure(lambda: aggregate_stage(rawdata, groups), len(groups)+1)
+		if 'fit' in stages:
+			result['fit'] = measure(lambda: fit_stage(rawdata, groups[:args.figures]), args.figures)
+		if 'render' in stages:
+			data_set = 'bench_%s' %(data_fmt)
+			write_data_set(workdir, data_set, path, data_fmt, groups[:args.figures])
+			# tracemalloc does not see the child processes (see max RSS)
+			result['render'] = measure(lambda: render_stage(workdir, data_set), args.figures, trace=False)
+
+		results['formats'][data_fmt] = result
+finally:
+	shutil.rmtree(workdir)
+
+# peak resident memory (kB on Linux) of this process and of visualize.py
+results['maxrss_mb']          = resource.getrusage(resource.RUSAGE_SELF    ).ru_maxrss/2.**10
+results['maxrss_children_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/2.**10
+
+
+# report________________________________________________________________________
+
+print('%d regions x %d days, sparsity %.2f' %(args.regions, args.days, args.sparsity))
+print('')
+print(' format          | stage     |  wall [s] |   cpu [s] |    throughput     | peak [MB]')
+print('-----------------+-----------+-----------+-----------+-------------------+----------')
+units = {'parse': 'cells/s', 'aggregate': 'groups/s', 'fit': 'fits/s', 'render': 'figs/s'}
+for data_fmt, result in results['formats'].items():
+	for stage in ['parse', 'aggregate', 'fit', 'render']:
+		if not(stage in result): continue
+		r = result[stage]
+		peak = '%9.1f' %(r['peak_mb']) if not(r['peak_mb'] is None) else '        -'
+		print(' %-15s | %-9s | %9.4f | %9.4f | %8.3g %-8s | %s'
+		      %(data_fmt, stage, r['wall'], r['cpu'], r['throughput'], units[stage], peak))
+print('')
+print('max RSS: %.1f MB (benchmark), %.1f MB (visualize.py)'
+      %(results['maxrss_mb'], results['maxrss_children_mb']))
+
+if not(args.output is None):
+	with open(args.output, 'w') as f: json.dump(results, f, indent=1)
@@ -11,23 +11,35 @@
 
 raw_data = {'path'    : 'data/JHU',
             'git_url' : 'https://github.com/CSSEGISandData/COVID-19.git',
-            'data_fmt': 'jhu'}
+            'data_fmt': 'jhu',
+            'depth'   : 1,     # shallow clone
+            'sparse'  : True}  # time-series only
+
+
+# groups________________________________________________________________________
+
+# dictionary of groups of regions: the key is the group name, while the value
+# is the list of names of its regions (or of other groups).
+groups = {'European Union': ['Austria', 'Belgium', 'Bulgaria', 'Croatia', 'Cyprus',
+                             'Czechia', 'Denmark', 'Estonia', 'Finland',
+                             'France', 'Germany', 'Greece', 'Hungary', 'Ireland',
+                             'Italy', 'Latvia', 'Lithuania', 'Luxembourg', 'Malta',
+                             'Netherlands', 'Poland', 'Portugal', 'Romania', 'Slovakia',
+                             'Slovenia', 'Spain', 'Sweden'],
+          'Europe'        : ['European Union',
+                             'Switzerland', 'Norway', 'United Kingdom'],
+          'North America' : ['US', 'Canada']}
 
 
 # figures_______________________________________________________________________
 
 # dictionary of figures: the key is the figure name, while the value is the
-# list of names of the selected regions. Set it to None for the World.
+# list of names of the selected regions (or groups). Set it to None for the
+# World.
 figures = {'Italy' : ['Italy'],
            'France': ['France'],
            'Spain' : ['Spain'],
-           'Europe': ['Austria', 'Belgium', 'Bulgaria', 'Croatia', 'Cyprus',
-                      'Czechia', 'Denmark', 'Estonia', 'Finland',
-                      'France', 'Germany', 'Greece', 'Hungary', 'Ireland',
-                      'Italy', 'Latvia', 'Lithuania', 'Luxembourg', 'Malta',
-                      'Netherlands', 'Poland', 'Portugal', 'Romania', 'Slovakia',
-                      'Slovenia', 'Spain', 'Sweden',
-                      'Switzerland', 'Norway', 'United Kingdom'],
-           'North America': ['US', 'Canada'],
+           'Europe': ['Europe'],
+           'North America': ['North America'],
            'China' : ['China'],
            'World' : None }
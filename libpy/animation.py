@@ -0,0 +1,87 @@
+##############################################################################80
+#                                                                              #
+#                                 Frame Writer                                 #
+#                                                                              #
+# (2020) Nicolo Fabbiane                                                       #
+#                                                                              #
+################################################################################
+
+# Frames (RGBA buffers of a canvas) streamed one at a time to a video or GIF
+# encoded by ffmpeg, or to a sequence of PNG files when ffmpeg is not found:
+# no frame is kept in memory.
+
+
+################################################################################
+# Writer
+#
+class FrameWriter:
+	"""
+	"""
+	def __init__(self, filename, width, height, fps=4):
+		"""
+		"""
+		# modules
+		import os
+		import shutil
+		import subprocess
+		# store data
+		self.filename = filename
+		self.width    = width
+		self.height   = height
+		self.count    = 0
+		self.ffmpeg   = shutil.which('ffmpeg')
+		# encoder reading raw frames from its input
+		if not(self.ffmpeg is None):
+			command = [self.ffmpeg, '-y', '-loglevel', 'error',
+			           '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '%dx%d' %(width, height),
+			           '-r', str(fps), '-i', '-']
+			if not(filename.endswith('.gif')):
+				# even sizes for the yuv420p players
+				command+= ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p']
+			self.process = subprocess.Popen(command + [filename], stdin=subprocess.PIPE)
+		# frames in a folder named as the output
+		else:
+			self.process = None
+			self.filename = os.path.splitext(filename)[0]
+			if not(os.path.isdir(self.filename)): os.makedirs(self.filename)
+	#___________________________________________________________________________
+	#
+	def write(self, rgba):
+		"""
+		"""
+		# modules
+		import os
+		import numpy as np
+		from matplotlib import pyplot as plt
+		rgba = np.asarray(rgba)
+		if rgba.shape[:2] != (self.height, self.width):
+			raise ValueError('frame of %dx%d pixels instead of %dx%d'
+			                 %(rgba.shape[1], rgba.shape[0], self.width, self.height))
+		if not(self.process is None):
+			self.process.stdin.write(np.ascontiguousarray(rgba, dtype=np.uint8).tobytes())
+		else:
+			plt.imsave(os.path.join(self.filename, 'frame_%05d.png' %(self.count)), rgba)
+		self.count+= 1
+	#___________________________________________________________________________
+	#
+	def close(self):
+		"""
+		"""
+		if self.process is None: return
+		self.process.stdin.close()
+		if self.process.wait() != 0:
+			raise RuntimeError('ffmpeg failed to write %s' %(self.filename))
+	#___________________________________________________________________________
+	#
+	def __enter__(self):
+		"""
+		"""
+		return self
+	#___________________________________________________________________________
+	#
+	def __exit__(self, *args):
+		"""
+		"""
+		self.close()
+	#___________________________________________________________________________
+	#
@@ -0,0 +1,404 @@
+##############################################################################80
+#                                                                              #
+#                                Logistic Fit                                  #
+#                                                                              #
+# (2020) Nicolo Fabbiane                                                       #
+#                                                                              #
+################################################################################
+
+# The cumulative confirmed cases (C), deaths (D) and recovered (R) are fitted
+# by three sigmoids A/(1 + exp((b-x)/a)) sharing the final values R = C - D.
+# The parameters are stored as (C, ac, bc, D, ad, bd, R, ar, br).
+
+
+# version of the fit (bump it when fit_logistic changes: the stored fits are
+# then computed again)
+fit_version = 2
+
+# root-mean-square error (relative to the confirmed cases) above which a fit
+# started from a previous solution is also started from the data
+warm_tolerance = 3e-3
+
+
+################################################################################
+# Functions
+#_______________________________________________________________________________
+#
+def sigmoid(x, A, a, b):
+	"""
+	"""
+	# modules
+	from scipy.special import expit
+	return A*expit((x-b)/a)
+#_______________________________________________________________________________
+#
+def dsigmoiddx(x, A, a, b):
+	"""
+	"""
+	# modules
+	from scipy.special import expit
+	s = expit((x-b)/a)
+	return A*s*(1.-s)/a
+#_______________________________________________________________________________
+#
+def fitfun(x, C, ac, bc, D, ad, bd, R, ar, br):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# recovered final value is not free
+	R = C-D
+	return np.stack([sigmoid(x, C, ac, bc),
+	                 sigmoid(x, D, ad, bd),
+	                 sigmoid(x, R, ar, br)], axis=-1)
+#_______________________________________________________________________________
+#
+def amplitudes(s, Ys, lower):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# final values C and D of least squares for the given sigmoids (days x
+	# curves, the recovered one scaled by C-D), not below the last data
+	ss = np.sum(s*s, axis=0); sY = np.sum(s*Ys, axis=0)
+	M = np.array([[ss[0]+ss[2],      -ss[2]],
+	              [     -ss[2], ss[1]+ss[2]]])
+	v = np.array([sY[0]+sY[2], sY[1]-sY[2]])
+	M+= 1e-12*np.trace(M)*np.eye(2) + 1e-300*np.eye(2)
+	# unconstrained solution, else the best one on the bounds
+	candidates = [np.linalg.solve(M, v),
+	              np.array([lower[0], max(lower[1], (v[1]-M[1, 0]*lower[0])/M[1, 1])]),
+	              np.array([max(lower[0], (v[0]-M[0, 1]*lower[1])/M[0, 0]), lower[1]])]
+	candidates = [A for A in candidates if np.all(A >= lower)]
+	return min(candidates, key=lambda A: .5*A.dot(M).dot(A) - v.dot(A))
+#_______________________________________________________________________________
+#
+def fiterr(q, x, Ys, lower):
+	"""
+	"""
+	# modules
+	import numpy as np
+	from scipy.special import expit
+	# widths and centers (the final values are solved for each of them)
+	ac, bc, ad, bd, ar, br = q
+	as_= np.array([ac, ad, ar])
+	bs = np.array([bc, bd, br])
+	# all curves at once (days x curves)
+	z = (x[:, None]-bs)/as_
+	s = expit(z)
+	C, D = amplitudes(s, Ys, lower)
+	As = np.array([C, D, C-D])
+	r = As*s - Ys
+	# error
+	error = np.sum(r**2)
+	# gradient w.r.t. widths and centers (the final values are optimal, or on
+	# their bounds: they do not contribute)
+	dz = 2.*r*As*s*(1.-s)
+	da = np.sum(dz*(-z/as_), axis=0)
+	db = np.sum(dz*(-1./as_), axis=0)
+	grad = np.array([da[0], db[0], da[1], db[1], da[2], db[2]])
+	return error, grad
+#_______________________________________________________________________________
+#
+def initial_guess(x, Ys, future=7):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# widths and centers of each curve from the days it reaches a quarter, half
+	# and three quarters of its last value (late center without data)
+	q = []
+	for Y in Ys.T:
+		if Y[-1] <= 0.:
+			q+= [1., future]; continue
+		i25, i50, i75 = [np.argmax(Y >= f*Y[-1]) for f in [.25, .5, .75]]
+		q+= [max(1., (x[i75]-x[i25])/(2.*np.log(3.))), x[i50]]
+	return np.array(q)
+#_______________________________________________________________________________
+#
+def fit_logistic(days, confirmed, deaths, recovered, future=7, p0=None):
+	"""
+	"""
+	# modules
+	import numpy as np
+	from scipy import optimize as spo
+	from scipy.special import expit
+	from . import profiling as pf
+	# data (scaled by the confirmed cases for a well-conditioned problem)
+	x = np.asarray(days, dtype=float)
+	Ys = np.stack([confirmed, deaths, recovered], axis=-1).astype(float)
+	scale = max(float(Ys[-1, 0]), 1.)
+	Ys = Ys/scale
+	lower = Ys[-1, :2]
+	# bounds (widths not below one day)
+	bd = ((1., np.inf), (-np.inf, np.inf))*3
+	# minimize with analytic gradient (the final values are linear: solved for
+	# each widths and centers)
+	def minimize(q0):
+		return spo.minimize(fiterr, args=(x, Ys, lower), x0=np.maximum(q0, [1., -np.inf]*3),
+		                    jac=True, bounds=bd, method='L-BFGS-B',
+		                    options={'ftol': 1e-12, 'gtol': 1e-10})
+	with pf.stage('fit'):
+		# from the given widths and centers (e.g. a previous fit) first: also
+		# from the data if it did not converge to a small error
+		sols = []
+		if not(p0 is None):
+			sols.append(minimize(np.array(p0, dtype=float)[[1, 2, 4, 5, 7, 8]]))
+		if (len(sols) == 0) or not(sols[0].success) or \
+		   (np.sqrt(sols[0].fun/Ys.size) > warm_tolerance):
+			sols.append(minimize(initial_guess(x, Ys, future)))
+		# from the default ones as well without a given guess
+		if p0 is None:
+			sols.append(minimize(np.array([1., future]*3)))
+		q = min(sols, key=lambda sol: sol.fun).x
+	# back to (C, ac, bc, D, ad, bd, R, ar, br)
+	ac, bc, ad, bd, ar, br = q
+	C, D = amplitudes(expit((x[:, None]-q[1::2])/q[0::2]), Ys, lower)
+	return np.array([C*scale, ac, bc, D*scale, ad, bd, (C-D)*scale, ar, br])
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# Bootstrap
+#_______________________________________________________________________________
+#
+def residuals_batch(q, x, Ys):
+	"""
+	"""
+	# modules
+	import numpy as np
+	from scipy.special import expit
+	# free parameters of each replicate (replicates x 8)
+	C, ac, bc, D, ad, bd, ar, br = q.T
+	As = np.stack([C, D, C-D], axis=-1)[:, None, :]
+	as_= np.stack([ac, ad, ar], axis=-1)[:, None, :]
+	bs = np.stack([bc, bd, br], axis=-1)[:, None, :]
+	# all replicates and curves at once (replicates x days x curves)
+	z = (x[None, :, None]-bs)/as_
+	s = expit(z)
+	r = As*s - Ys
+	# jacobian w.r.t. final values, widths and centers (replicates x days x curves x 8)
+	dz = As*s*(1.-s)
+	da = dz*(-z/as_)
+	db = dz*(-1./as_)
+	J = np.zeros(r.shape + (8,))
+	J[:, :, 0, 0] = s[:, :, 0]; J[:, :, 2, 0] =  s[:, :, 2]
+	J[:, :, 1, 3] = s[:, :, 1]; J[:, :, 2, 3] = -s[:, :, 2]
+	J[:, :, 0, 1] = da[:, :, 0]; J[:, :, 0, 2] = db[:, :, 0]
+	J[:, :, 1, 4] = da[:, :, 1]; J[:, :, 1, 5] = db[:, :, 1]
+	J[:, :, 2, 6] = da[:, :, 2]; J[:, :, 2, 7] = db[:, :, 2]
+	return r.reshape(len(q), -1), J.reshape(len(q), -1, 8)
+#_______________________________________________________________________________
+#
+def fit_logistic_batch(days, Ys, p0, iterations=100):
+	"""
+	"""
+	# modules
+	import numpy as np
+	from . import profiling as pf
+	# data of all replicates (replicates x days x [C, D, R]), common scale
+	x = np.asarray(days, dtype=float)
+	Ys = np.asarray(Ys, dtype=float)
+	scale = max(float(np.median(Ys[:, -1, 0])), 1.)
+	Ys = Ys/scale
+	nrep = Ys.shape[0]
+	# same initial guess for all replicates (e.g. the fit of the original data)
+	p0 = np.array(p0, dtype=float); p0[[0, 3, 6]]/= scale
+	q = np.tile(np.delete(p0, 6), (nrep, 1))
+	# bounds (final values not below the last data, widths not below one day)
+	lb = np.tile([0., 1., -np.inf, 0., 1., -np.inf, 1., -np.inf], (nrep, 1))
+	lb[:, 0] = Ys[:, -1, 0]; lb[:, 3] = Ys[:, -1, 1]
+	q = np.maximum(q, lb)
+	# Levenberg-Marquardt iterations of all replicates at once (the problems are
+	# independent: one 8x8 system for each replicate)
+	with pf.stage('fit'):
+		r, J = residuals_batch(q, x, Ys)
+		error = np.sum(r**2, axis=1)
+		damping = np.full(nrep, 1e-3)
+		for _ in range(iterations):
+			JJ = np.matmul(J.transpose(0, 2, 1), J)
+			Jr = np.matmul(J.transpose(0, 2, 1), r[:, :, None])
+			A  = JJ + damping[:, None, None]*(JJ*np.eye(8) + 1e-12*np.eye(8))
+			q_new = np.maximum(q - np.linalg.solve(A, Jr)[:, :, 0], lb)
+			r_new, J_new = residuals_batch(q_new, x, Ys)
+			error_new = np.sum(r_new**2, axis=1)
+			# accept the improving steps (and trust the model more)
+			better = error_new < error
+			gain   = np.where(better, error - error_new, 0.)
+			q[better] = q_new[better]; r[better] = r_new[better]; J[better] = J_new[better]
+			error[better] = error_new[better]
+			damping = np.where(better, damping/3., damping*2.)
+			# converged: negligible gain, or no better step found
+			done = (better & (gain <= 1e-10*error)) | (~better & (damping > 1e6))
+			if np.all(done): break
+	# back to (C, ac, bc, D, ad, bd, R, ar, br)
+	C, ac, bc, D, ad, bd, ar, br = q.T
+	return np.stack([C*scale, ac, bc, D*scale, ad, bd, (C-D)*scale, ar, br], axis=-1)
+#_______________________________________________________________________________
+#
+def bootstrap_logistic(days, confirmed, deaths, recovered, psig, nboot=200, seed=0):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# daily increments of the data and of the fit (days x [C, D, R])
+	x = np.asarray(days, dtype=float)
+	Y = np.stack([confirmed, deaths, recovered], axis=-1).astype(float)
+	F = fitfun(x, *psig)
+	increments     = np.diff(Y, axis=0, prepend=0.)
+	fit_increments = np.diff(F, axis=0, prepend=0.)
+	residuals = increments - fit_increments
+	# resampled residuals (the same day for the three curves, not clipped to
+	# keep the replicates unbiased)
+	rng = np.random.default_rng(seed)
+	picks = rng.integers(0, len(x), (nboot, len(x)))
+	Ys = np.cumsum(fit_increments[None] + residuals[picks], axis=1)
+	# refit all replicates starting from the fit of the data
+	return fit_logistic_batch(x, Ys, psig)
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# Backtest
+#_______________________________________________________________________________
+#
+def fit_logistic_sequence(days, confirmed, deaths, recovered, cutoffs, future=7):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# data (days x [C, D, R])
+	x = np.asarray(days)
+	Y = np.stack([confirmed, deaths, recovered], axis=-1).astype(float)
+	# fit of the data up to each cut-off (days counted from the cut-off),
+	# starting from the fit of the previous one
+	psig = None; previous = None
+	for c in cutoffs:
+		if not(psig is None):
+			psig = np.array(psig); psig[[2, 5, 8]]-= x[c] - x[previous]
+		psig = fit_logistic(x[:c+1]-x[c], Y[:c+1, 0], Y[:c+1, 1], Y[:c+1, 2], future=future, p0=psig)
+		previous = c
+		yield c, psig
+#_______________________________________________________________________________
+#
+def backtest_logistic(days, confirmed, deaths, recovered, future=7, start=14, step=1):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# data (days x [C, D, R])
+	x = np.asarray(days)
+	Y = np.stack([confirmed, deaths, recovered], axis=-1).astype(float)
+	# cut-offs with at least `start` days of data and one day to forecast
+	cutoffs = list(range(start-1, len(x)-1, step))
+	# relative error of the forecast of each cut-off and horizon (cut-offs x
+	# horizons x [C, D, R]; nan where the actual value is not known or zero)
+	errors = np.full((len(cutoffs), future, 3), np.nan)
+	fits = fit_logistic_sequence(x, confirmed, deaths, recovered, cutoffs, future)
+	for i, (c, psig) in enumerate(fits):
+		# forecast of the days known after the cut-off
+		horizon = x[c+1:] - x[c]
+		known   = (horizon <= future)
+		actual  = Y[c+1:][known]
+		forecast= fitfun(horizon[known].astype(float), *psig)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			errors[i, horizon[known]-1] = np.where(actual > 0, forecast/actual - 1., np.nan)
+	return np.array(cutoffs, dtype=int), errors
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# Fit cache
+#
+class FitCache:
+	"""
+	"""
+	def __init__(self, filename):
+		"""
+		"""
+		# modules
+		import os
+		import json
+		# store data
+		self.filename = filename
+		self.entries  = {}
+		# load previous fits (a corrupted file is simply ignored)
+		if os.path.isfile(filename):
+			try:
+				with open(filename, 'r') as f: self.entries = json.load(f)
+			except ValueError:
+				self.entries = {}
+	#___________________________________________________________________________
+	#
+	def lookup(self, key, time, confirmed, deaths, recovered):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# no previous fit (or by another version of the fit)
+		if not(key in self.entries): return None, None
+		entry = self.entries[key]
+		if entry.get('version') != fit_version: return None, None
+		n = entry['n']
+		# same series: reuse the fit
+		if (len(time) == n) and (series_hash(confirmed, deaths, recovered) == entry['hash']):
+			return np.array(entry['psig']), None
+		# series grown by new days: previous fit as initial guess
+		if (len(time) > n) and (series_hash(confirmed[:n], deaths[:n], recovered[:n]) == entry['hash']):
+			# days are counted from the last one: shift the centers
+			shift = (time[-1] - time[n-1]).days
+			p0 = np.array(entry['psig']); p0[[2, 5, 8]]-= shift
+			return None, p0
+		# data changed
+		return None, None
+	#___________________________________________________________________________
+	#
+	def store(self, key, time, confirmed, deaths, recovered, psig):
+		"""
+		"""
+		self.entries[key] = {'version': fit_version,
+		                     'n'      : len(time),
+		                     'hash'   : series_hash(confirmed, deaths, recovered),
+		                     'psig'   : [float(p) for p in psig]}
+		return self.entries[key]
+	#___________________________________________________________________________
+	#
+	def save(self):
+		"""
+		"""
+		# modules
+		import os
+		import json
+		# write to a temporary file first (never leave a truncated cache)
+		tmpname = self.filename + '.tmp'
+		with open(tmpname, 'w') as f: json.dump(self.entries, f)
+		os.replace(tmpname, self.filename)
+	#___________________________________________________________________________
+	#
+
+
+
+
+################################################################################
+# Support functions
+#_______________________________________________________________________________
+#
+def series_hash(confirmed, deaths, recovered):
+	"""
+	"""
+	# modules
+	import hashlib
+	import numpy as np
+	series = np.stack([confirmed, deaths, recovered], axis=-1).astype(np.int64)
+	return hashlib.sha1(np.ascontiguousarray(series).tobytes()).hexdigest()
+#_______________________________________________________________________________
+#
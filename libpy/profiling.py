@@ -0,0 +1,282 @@
+##############################################################################80
+#                                                                              #
+#                                  Profiling                                   #
+#                                                                              #
+# (2020) Nicolo Fabbiane                                                       #
+#                                                                              #
+################################################################################
+
+# Per-stage instrumentation: wall time, CPU time (of the running thread),
+# number of calls and peak resident memory of each stage (git, read, cache,
+# clean, aggregate, derive, fit, render, ...) and figure. Disabled by default;
+# enabled by enable() or by the COVID19_PROFILE environment variable (output
+# file), with an optional cProfile of the stage in COVID19_PROFILE_STAGE.
+
+# modules
+import os
+import time
+import threading
+import contextlib
+
+
+# state_________________________________________________________________________
+
+# settings
+settings = {'enabled' : False,
+            'output'  : None,  # JSON or CSV file (by extension)
+            'cprofile': None}  # stage profiled with cProfile
+
+# records for each (stage, figure)
+records = {}
+
+# cProfile statistics of the finished stages (one dict for each process)
+cprofile_stats = []
+
+# lock for the records and the profiler (stages run in several threads)
+lock = threading.Lock()
+
+# current figure and active stages of each thread
+local = threading.local()
+
+# cProfile profilers (of each thread: a profiler only sees its own thread),
+# with the depth of the profiled stage in the thread
+cprofilers = []
+cprofiler  = threading.local()
+
+
+
+
+################################################################################
+# Settings
+#_______________________________________________________________________________
+#
+def enable(output=None, cprofile=None):
+	"""
+	"""
+	settings['enabled']  = True
+	settings['output']   = output
+	settings['cprofile'] = cprofile
+#_______________________________________________________________________________
+#
+def is_enabled():
+	"""
+	"""
+	return settings['enabled']
+#_______________________________________________________________________________
+#
+# from the environment
+if os.environ.get('COVID19_PROFILE'):
+	enable(os.environ['COVID19_PROFILE'], os.environ.get('COVID19_PROFILE_STAGE') or None)
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# Instrumentation
+#_______________________________________________________________________________
+#
+@contextlib.contextmanager
+def stage(name):
+	"""
+	"""
+	# disabled or nested in the same stage (counted once)
+	active = getattr(local, 'stages', None)
+	if active is None: active = local.stages = []
+	if not(settings['enabled']) or (name in active):
+		yield
+		return
+	# start
+	active.append(name)
+	profiling = (name == settings['cprofile'])
+	if profiling: start_cprofile()
+	w0 = time.perf_counter(); c0 = time.thread_time()
+	try:
+		yield
+	finally:
+		# stop and record
+		wall = time.perf_counter() - w0; cpu = time.thread_time() - c0
+		if profiling: stop_cprofile()
+		active.pop()
+		record(name, getattr(local, 'figure', None), 1, wall, cpu, peak_rss())
+#_______________________________________________________________________________
+#
+@contextlib.contextmanager
+def figure(name):
+	"""
+	"""
+	# stages of this thread are attributed to the figure
+	local.figure = name
+	try:
+		with stage('figure'): yield
+	finally:
+		local.figure = None
+#_______________________________________________________________________________
+#
+def record(name, figure, calls, wall, cpu, maxrss):
+	"""
+	"""
+	with lock:
+		key = (name, figure)
+		if not(key in records):
+			records[key] = {'stage': name, 'figure': figure, 'calls': 0,
+			                'wall': 0., 'cpu': 0., 'maxrss_mb': 0.}
+		entry = records[key]
+		entry['calls']    += calls
+		entry['wall']     += wall
+		entry['cpu']      += cpu
+		entry['maxrss_mb'] = max(entry['maxrss_mb'], maxrss)
+#_______________________________________________________________________________
+#
+def peak_rss():
+	"""
+	"""
+	# modules
+	import sys
+	import resource
+	# peak resident memory of the process so far (bytes on macOS, kB on Linux)
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return maxrss/2.**20 if sys.platform == 'darwin' else maxrss/2.**10
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# cProfile
+#_______________________________________________________________________________
+#
+def start_cprofile():
+	"""
+	"""
+	# modules
+	import cProfile
+	# profiler of this thread (a new one after the statistics were taken)
+	cprofiler.depth = getattr(cprofiler, 'depth', 0) + 1
+	if cprofiler.depth > 1: return
+	with lock:
+		if not(getattr(cprofiler, 'profile', None) in cprofilers):
+			cprofiler.profile = cProfile.Profile()
+			cprofilers.append(cprofiler.profile)
+	cprofiler.profile.enable()
+#_______________________________________________________________________________
+#
+def stop_cprofile():
+	"""
+	"""
+	cprofiler.depth-= 1
+	if cprofiler.depth > 0: return
+	cprofiler.profile.disable()
+#_______________________________________________________________________________
+#
+def take_cprofile():
+	"""
+	"""
+	# modules
+	import pstats
+	# statistics collected so far by the threads of this process (merged)
+	with lock:
+		profiles = list(cprofilers)
+		cprofilers.clear()
+	if len(profiles) == 0: return None
+	return pstats.Stats(*profiles).stats
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# Collection and output
+#_______________________________________________________________________________
+#
+def take():
+	"""
+	"""
+	# records and cProfile statistics of this process (e.g. of a worker, to be
+	# merged by the main process), then reset
+	with lock:
+		taken = list(records.values())
+		records.clear()
+	return taken, take_cprofile()
+#_______________________________________________________________________________
+#
+def reset():
+	"""
+	"""
+	# e.g. in a forked worker, which inherits the records of its parent
+	take()
+#_______________________________________________________________________________
+#
+def merge(taken):
+	"""
+	"""
+	entries, stats = taken
+	for entry in entries:
+		record(entry['stage'], entry['figure'], entry['calls'],
+		       entry['wall'], entry['cpu'], entry['maxrss_mb'])
+	if not(stats is None): cprofile_stats.append(stats)
+#_______________________________________________________________________________
+#
+def get_records():
+	"""
+	"""
+	with lock:
+		entries = [dict(entry) for entry in records.values()]
+	# totals of each stage over all figures (figure '*')
+	totals = {}
+	for entry in entries:
+		if entry['figure'] is None: continue
+		if not(entry['stage'] in totals):
+			totals[entry['stage']] = {'stage': entry['stage'], 'figure': '*', 'calls': 0,
+			                          'wall': 0., 'cpu': 0., 'maxrss_mb': 0.}
+		total = totals[entry['stage']]
+		for k in ['calls', 'wall', 'cpu']: total[k]+= entry[k]
+		total['maxrss_mb'] = max(total['maxrss_mb'], entry['maxrss_mb'])
+	entries+= list(totals.values())
+	# for each stage: outside figures, all figures, then each figure
+	order = {None: '', '*': '*'}
+	entries.sort(key=lambda e: (e['stage'], order.get(e['figure'], '+' + str(e['figure']))))
+	return entries
+#_______________________________________________________________________________
+#
+def write(filename=None):
+	"""
+	"""
+	# modules
+	import csv
+	import json
+	# output file
+	filename = filename or settings['output']
+	if filename is None: return
+	entries = get_records()
+	if filename.endswith('.csv'):
+		with open(filename, 'w', newline='') as f:
+			writer = csv.DictWriter(f, fieldnames=['stage', 'figure', 'calls', 'wall', 'cpu', 'maxrss_mb'])
+			writer.writeheader()
+			for entry in entries: writer.writerow(entry)
+	else:
+		with open(filename, 'w') as f: json.dump(entries, f, indent=1)
+	# cProfile statistics of the selected stage (all processes)
+	if not(settings['cprofile'] is None):
+		write_cprofile('%s_%s.prof' %(os.path.splitext(filename)[0], settings['cprofile']))
+#_______________________________________________________________________________
+#
+def write_cprofile(filename):
+	"""
+	"""
+	# modules
+	import pstats
+	# statistics of this process and of the merged ones
+	stats = [s for s in cprofile_stats + [take_cprofile()] if not(s is None)]
+	if len(stats) == 0: return
+	total = None
+	for s in stats:
+		st = pstats.Stats()
+		st.stats = dict(s); st.get_top_level_stats()
+		total = st if total is None else total.add(st)
+	total.dump_stats(filename)
+#_______________________________________________________________________________
+#
@@ -6,10 +6,125 @@
 #                                                                              #
 ################################################################################
 
+# metrics of the aggregated data (RawData.get_data_for_regions); RawData.data
+# stores only the ones read from the files (RawData.columns)
+metrics = ('confirmed', 'recovered', 'deaths', 'active', 'intensive')
+
+# type of the stored series (summed as int64)
+storage_dtype = 'int32'
+
+# separator of the levels in the region names, from the coarsest to the finest
+# (e.g. 'US/New York/Kings'; escaped by a backslash inside a level name)
+level_separator = '/'
+
+# version of the readers output (bump it to invalidate the cached data)
+reader_version = 6
+
+# schema of the time-series of each data format (more formats can be declared
+# by the data-set modules, see register_format):
+#   'layout' : 'long' (one line for each day and region) or 'wide' (one file for
+#              each metric, one column for each day)
+#   'dirs'   : directories holding the files (checked-out by sparse clones)
+#   'files'  : file (long) or {metric: file} (wide), relative to the repo
+#   'region' : column holding the region name, or columns of its levels from
+#              the coarsest to the finest (rows of the same region summed in
+#              the wide layout)
+#   'date'   : column holding the 'YYYY-MM-DD...' time-stamps (long), or
+#              strptime format of the date columns of the header (wide)
+#   'metrics': {metric: column or [alternative columns, ...]} (long, missing
+#              metrics are zero)
+#   'filters': {column: [substring, ...]} lines kept if each column holds one
+#              of its substrings (long, optional)
+#   'combine': 'max' or 'sum' to combine the lines of the same region and day
+#              (long, optional: the last line is kept)
+#   'active' : active cases computed as confirmed - recovered - deaths (when
+#              aggregated, not stored)
+formats = {'jhu': {'layout' : 'wide',
+                   'dirs'   : ['csse_covid_19_data/csse_covid_19_time_series'],
+                   'files'  : {'confirmed': 'csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Confirmed.csv',
+                               'recovered': 'csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Recovered.csv',
+                               'deaths'   : 'csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-Deaths.csv'},
+                   'region' : ['Country/Region', 'Province/State'],
+                   'date'   : '%m/%d/%y',
+                   'active' : True},
+           'jhu-us': {'layout' : 'wide',
+                   'dirs'   : ['csse_covid_19_data/csse_covid_19_time_series'],
+                   'files'  : {'confirmed': 'csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv',
+                               'deaths'   : 'csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'},
+                   'region' : ['Country_Region', 'Province_State', 'Admin2'],
+                   'date'   : '%m/%d/%y'},
+           'dpc': {'layout' : 'long',
+                   'dirs'   : ['dati-regioni'],
+                   'files'  : 'dati-regioni/dpc-covid19-ita-regioni.csv',
+                   'region' : 'denominazione_regione',
+                   'date'   : 'data',
+                   'metrics': {'confirmed': 'totale_casi',
+                               'recovered': 'dimessi_guariti',
+                               'deaths'   : 'deceduti',
+                               'active'   : ['totale_positivi', 'totale_attualmente_positivi'],
+                               'intensive': 'terapia_intensiva'}},
+           'dpc-province': {'layout' : 'long',
+                   'dirs'   : ['dati-province'],
+                   'files'  : 'dati-province/dpc-covid19-ita-province.csv',
+                   'region' : ['denominazione_regione', 'denominazione_provincia'],
+                   'date'   : 'data',
+                   'metrics': {'confirmed': 'totale_casi'}},
+           'ofr': {'layout' : 'long',
+                   'dirs'   : ['dist'],
+                   'files'  : 'dist/chiffres-cles.csv',
+                   'region' : 'maille_nom',
+                   'date'   : 'date',
+                   'metrics': {'confirmed': 'cas_confirmes',
+                               'recovered': 'gueris',
+                               'deaths'   : 'deces',
+                               'intensive': 'reanimation'},
+                   'filters': {'maille_code': ['REG', 'FRA'],
+                               'source_nom' : ['et de la Sant', 'ARS']},
+                   'combine': 'max',
+                   'active' : True},
+           'ofr-departement': {'layout' : 'long',
+                   'dirs'   : ['dist'],
+                   'files'  : 'dist/chiffres-cles.csv',
+                   'region' : 'maille_nom',
+                   'date'   : 'date',
+                   'metrics': {'confirmed': 'cas_confirmes',
+                               'recovered': 'gueris',
+                               'deaths'   : 'deces',
+                               'intensive': 'reanimation'},
+                   'filters': {'maille_code': ['DEP'],
+                               'source_nom' : ['Sant', 'ARS']},
+                   'combine': 'max',
+                   'active' : True}}
+
+# schemas compiled for the header of a file (by format and header)
+compiled = {}
+
+# cleaning: increments larger than outlier_factor times the mean increment of
+# the previous week (and than outlier_min) are flagged as outliers
+outlier_factor = 5.
+outlier_min    = 10
+
+# derived metrics of RawData.get_derived (see derive_data), and days of the
+# rolling means and of the doubling times
+derived = ('increments', 'mean', 'growth', 'doubling', 'peaks', 'increment_peaks')
+rolling_window = 7
+
+# size of the chunks read from the data files (bytes)
+chunk_size = 1 << 24
+
+# version of the processed-data format written by RawData.export_processed:
+# <name>.npy holds the data as an integer array (stored metrics x regions x
+# time, one contiguous block for each metric) and <name>.json the index
+# (format, version, data_fmt, head, metrics, regions and 'YYYY-MM-DD' dates
+# along the axes of the array, derived active cases, data file name)
+processed_version = 2
+
 class RawData:
 	"""
 	"""
-	def __init__(self, path='data', git_url=None, git_env={}, data_fmt='jhu'):
+	def __init__(self, path='data', git_url=None, git_env={}, data_fmt='jhu',
+	             cache=True, offline=False, max_age=None, depth=None, sparse=False,
+	             select=None, lazy=True):
 		"""
 		"""
 		# store data
@@ -17,18 +132,68 @@ class RawData:
 		self.git_url   = git_url
 		self.git_env   = git_env
 		self.data_fmt  = data_fmt
-		self.time      = {}
-		self.confirmed = {}
-		self.recovered = {}
-		self.deaths    = {}
-		self.active    = {}
-		self.intensive = {}
-		# initialize
-		self.update_git()
+		self.cache     = cache
+		self.offline   = offline # never pull/clone
+		self.max_age   = max_age # minutes since the last fetch before pulling again
+		self.depth     = depth   # shallow clone
+		self.sparse    = sparse  # clone only the time-series directories
+		self.select    = select  # regions (or groups) kept while reading (None: all)
+		self.time      = []
+		self.regions   = [] # finest level available (e.g. 'US/New York/Kings')
+		self.index     = {} # {region or parent region: [row, ...]}
+		self.ambiguous = {} # {level name: [qualified name, ...]} (not in index)
+		self.data      = None    # regions x time x columns
+		self.columns   = metrics # metrics stored in data
+		self.active    = False   # active cases derived when aggregated
+		self.groups    = {} # {group: [region or group, ...]}
+		self.aggregates= {} # cached sums (by set of regions)
+		self.derived   = {} # cached derived metrics (by name and set of regions)
+		self.missing   = set() # regions not found in the data
+		self.masks     = {}    # cells filled/corrected/flagged by clean_data (as data)
+		# load data now (otherwise on first access)
+		if not(lazy): self.load()
+	#___________________________________________________________________________
+	#
+	def load(self):
+		"""
+		"""
+		# modules
+		from . import profiling as pf
+		# update data repo (unless offline or recently fetched)
+		if not(self.offline) and not(self.is_fresh()):
+			with pf.stage('git'): self.update_git()
 		# read data
 		self.read_data()
 	#___________________________________________________________________________
 	#
+	def is_loaded(self):
+		"""
+		"""
+		return not(self.data is None)
+	#___________________________________________________________________________
+	#
+	def is_fresh(self):
+		"""
+		"""
+		# modules
+		import os
+		import time
+		# no freshness policy
+		if self.max_age is None: return False
+		# time of the last fetch
+		stamp = self.get_fetch_stamp()
+		if not(os.path.isfile(stamp)): return False
+		return (time.time() - os.path.getmtime(stamp)) < self.max_age*60.
+	#___________________________________________________________________________
+	#
+	def get_fetch_stamp(self):
+		"""
+		"""
+		# modules
+		import os
+		return os.path.join(self.path, '.git', 'rawdata_fetched')
+	#___________________________________________________________________________
+	#
 	def update_git(self):
 		"""
 		"""
@@ -42,78 +207,502 @@ class RawData:
 			# update (pull)
 			origin.pull(env=self.git_env)
 		elif not(self.git_url is None):
+			# clone options
+			options = []
+			if not(self.depth is None): options.append('--depth=%d' %(self.depth))
+			if self.sparse: options+= ['--filter=blob:none', '--sparse']
 			# clone repo from url
-			repo = Repo.clone_from(self.git_url, self.path, env=self.git_env)
+			repo = Repo.clone_from(self.git_url, self.path, env=self.git_env,
+			                       multi_options=options)
+			# check-out only the time-series
+			if self.sparse:
+				repo.git.sparse_checkout('set', *formats.get(self.data_fmt, {}).get('dirs', []))
+		else:
+			return
+		# time of the last fetch
+		with open(self.get_fetch_stamp(), 'w'): pass
+	#___________________________________________________________________________
+	#
+	def get_head(self):
+		"""
+		"""
+		# modules
+		from git import Repo, InvalidGitRepositoryError, NoSuchPathError
+		# commit checked-out in the data repo (None if not a repo)
+		try: return Repo(self.path).head.commit.hexsha
+		except (InvalidGitRepositoryError, NoSuchPathError, ValueError): return None
+	#___________________________________________________________________________
+	#
+	def get_cache_file(self):
+		"""
+		"""
+		# modules
+		import os
+		# stored in the repo metadata, out of the working tree
+		return os.path.join(self.path, '.git', 'rawdata_%s.npz' %(self.data_fmt))
+	#___________________________________________________________________________
+	#
+	def is_ancestor(self, commit, head):
+		"""
+		"""
+		# modules
+		from git import Repo, GitCommandError
+		# False also when the commit is gone (history rewritten)
+		try: return Repo(self.path).is_ancestor(commit, head)
+		except (GitCommandError, ValueError): return False
 	#___________________________________________________________________________
 	#
 	def read_data(self):
 		"""
 		"""
-		# select reader
-		if self.data_fmt is 'jhu': # John Hopkins University
-			data = read_data_jhu(self)
-		elif self.data_fmt is 'dpc': # Dipartimento della protezione Civile
-			data = read_data_dpc(self)
-		elif self.data_fmt is 'ofr': # OpenCoVid19-fr
-			data = read_data_ofr(self)
-		else: # default (John Hopkins University)
-			data = read_data_jhu(self)
-		# unpack data
-		self.time      = data[0]
-		self.confirmed = data[1]
-		self.recovered = data[2]
-		self.deaths    = data[3]
-		self.active    = data[4]
-		self.intensive = data[5]
+		# modules
+		import json
+		import hashlib
+		from . import profiling as pf
+		# schema of the data format (unknown formats are not guessed)
+		schema = get_format(self.data_fmt)
+		# cache key (data-set commit, reader version, schema and selected regions)
+		head = self.get_head() if self.cache else None
+		key  = '%s-%d-%s' %(self.data_fmt, reader_version,
+		                    hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest())
+		selection = self.get_selection()
+		if not(selection is None):
+			key+= '-' + hashlib.sha1('\n'.join(sorted(selection)).encode()).hexdigest()
+		# load cached data
+		cached = None
+		if not(head is None):
+			with pf.stage('cache'): cached = load_cache(self.get_cache_file())
+			if not(cached is None) and cached['key'] != key: cached = None
+		# cached data up to date
+		if not(cached is None) and cached['head'] == head:
+			self.set_clean_data(cached['time'], cached['regions'], cached['data'])
+			return
+		# incremental update only if upstream did not rewrite the history
+		state = None
+		if not(cached is None) and self.is_ancestor(cached['head'], head):
+			state = cached['state']
+		with pf.stage('read'):
+			# reader of the layout
+			if schema['layout'] == 'wide':
+				data = read_data_wide(self, schema, state)
+			else:
+				data = read_data_long(self, schema, state)
+			time, regions, values, present, state = data
+			# only the new data were read: merge them
+			if state['append']:
+				time, regions, values = merge_data(cached['time'], cached['regions'], cached['data'],
+				                                   time, regions, values, present, schema.get('combine'))
+		# update cache (data as read, cleaned at each load)
+		if not(head is None):
+			with pf.stage('cache'):
+				save_cache(self.get_cache_file(), key, head, state,
+				           time, regions, values)
+		self.set_clean_data(time, regions, values)
+	#___________________________________________________________________________
+	#
+	def set_clean_data(self, time, regions, data):
+		"""
+		"""
+		# modules
+		from . import profiling as pf
+		# metrics read by the format
+		schema  = get_format(self.data_fmt)
+		columns = stored_metrics(schema)
+		# same cleaning for all formats (after the merge of the new data), on
+		# every day (the days missing from the whole files are filled too)
+		with pf.stage('clean'):
+			time, data = fill_calendar(time, data)
+			data, masks = clean_data(data, columns)
+		self.set_data(time, regions, data, columns, schema.get('active', False))
+		self.masks = masks
+	#___________________________________________________________________________
+	#
+	def set_data(self, time, regions, data, columns=metrics, active=False):
+		"""
+		"""
+		self.time    = list(time)
+		self.regions = list(regions)
+		self.data    = data
+		self.columns = tuple(columns)
+		self.active  = active
+		self.index, self.ambiguous = index_regions(self.regions)
+		# cached aggregates and derived metrics are outdated
+		self.aggregates = {}
+		self.derived    = {}
+	#___________________________________________________________________________
+	#
+	def get_processed_file(self):
+		"""
+		"""
+		# modules
+		import os
+		# stored in the repo metadata, out of the working tree (no extension), or
+		# in the data folder if it is not a git clone
+		folder = os.path.join(self.path, '.git')
+		if not(os.path.isdir(folder)): folder = self.path
+		return os.path.join(folder, 'processed_%s' %(self.data_fmt))
+	#___________________________________________________________________________
+	#
+	def export_processed(self, filename=None):
+		"""
+		"""
+		# modules
+		import os
+		import glob
+		import json
+		import hashlib
+		import numpy as np
+		# load data on first access
+		if not(self.is_loaded()): self.load()
+		filename = filename or self.get_processed_file()
+		if not(os.path.isdir(os.path.dirname(os.path.abspath(filename)))):
+			os.makedirs(os.path.dirname(os.path.abspath(filename)))
+		# data array under a name of its own (its content hash): readers attached
+		# to a previous version keep it, and the new one is not visible until
+		# the index is replaced
+		digest = hashlib.sha1(np.ascontiguousarray(self.data).tobytes()).hexdigest()[:16]
+		dataname = '%s-%s.npy' %(filename, digest)
+		if not(os.path.isfile(dataname)):
+			tmpname = dataname + '.tmp.npy'
+			columns = np.lib.format.open_memmap(tmpname, mode='w+', dtype=self.data.dtype,
+			                                    shape=(self.data.shape[2],)+self.data.shape[:2])
+			columns[:] = np.moveaxis(self.data, 2, 0)
+			columns.flush(); del columns
+			os.replace(tmpname, dataname)
+		# index sidecar (replaced at once: the only commit point)
+		previous = None
+		if os.path.isfile(filename + '.json'):
+			try:
+				with open(filename + '.json', 'r') as f: previous = json.load(f).get('data')
+			except ValueError:
+				pass
+		index = {'format'  : 'rawdata-processed',
+		         'version' : processed_version,
+		         'data_fmt': self.data_fmt,
+		         'head'    : self.get_head(),
+		         'metrics' : list(self.columns),
+		         'regions' : self.regions,
+		         'time'    : [t.strftime('%Y-%m-%d') for t in self.time],
+		         'active'  : self.active,
+		         'data'    : os.path.basename(dataname)}
+		with open(filename + '.tmp.json', 'w') as f: json.dump(index, f)
+		os.replace(filename + '.tmp.json', filename + '.json')
+		# older arrays (the previous one is kept for the readers of its index)
+		keep = [os.path.basename(dataname), previous]
+		for name in glob.glob(glob.escape(filename) + '-*.npy'):
+			if not(os.path.basename(name) in keep): os.remove(name)
+		return filename
+	#___________________________________________________________________________
+	#
+	@classmethod
+	def open_processed(cls, filename, **kwargs):
+		"""
+		"""
+		# modules
+		import os
+		import json
+		import datetime as dt
+		import numpy as np
+		# index sidecar
+		with open(filename + '.json', 'r') as f: index = json.load(f)
+		if (index.get('format') != 'rawdata-processed') or (index.get('version') != processed_version):
+			raise ValueError('%s: unsupported processed-data format' %(filename))
+		if not(all([metric in metrics for metric in index['metrics']])):
+			raise ValueError('%s: unexpected metrics %s' %(filename, index['metrics']))
+		# data array mapped read-only (pages shared by all processes)
+		columns = np.load(os.path.join(os.path.dirname(filename), index['data']), mmap_mode='r')
+		# raw data (never read from the repository)
+		kwargs.setdefault('data_fmt', index['data_fmt'])
+		kwargs.setdefault('offline', True)
+		rawdata = cls(**kwargs)
+		rawdata.set_data([dt.datetime.strptime(t, '%Y-%m-%d') for t in index['time']],
+		                 index['regions'], np.moveaxis(columns, 0, 2), index['metrics'], index['active'])
+		return rawdata
+	#___________________________________________________________________________
+	#
+	def set_groups(self, groups):
+		"""
+		"""
+		self.groups     = dict(groups)
+		self.aggregates = {}
+	#___________________________________________________________________________
+	#
+	def precompute_groups(self):
+		"""
+		"""
+		for group in self.groups.keys(): self.get_data_for_regions([group])
+	#___________________________________________________________________________
+	#
+	def expand_groups(self, regions):
+		"""
+		"""
+		# expand groups (a group name hides a region with the same name)
+		names = set(); stack = [(region, ()) for region in regions]
+		while stack:
+			region, parents = stack.pop()
+			if region in self.groups:
+				if region in parents: continue # cyclic definition
+				stack+= [(member, parents+(region,)) for member in self.groups[region]]
+			else:
+				names.add(region)
+		return names
+	#___________________________________________________________________________
+	#
+	def get_selection(self):
+		"""
+		"""
+		# names of the regions kept by the readers (None: all)
+		if self.select is None: return None
+		return self.expand_groups(self.select)
+	#___________________________________________________________________________
+	#
+	def get_rows(self, regions):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# all regions
+		if not(isinstance(regions, list)): return np.arange(len(self.regions))
+		rows = set()
+		for region in self.expand_groups(regions):
+			if region in self.index:
+				rows.update(self.index[region])
+			elif (region in self.ambiguous) and not(region in self.missing):
+				# the qualified name is required
+				self.missing.add(region)
+				print('WARNING! %s is ambiguous (%s)' %(region, ', '.join(self.ambiguous[region])))
+			elif not(region in self.missing):
+				# report missing regions only once
+				self.missing.add(region)
+				print('WARNING! %s not found' %(region))
+		return np.array(sorted(rows), dtype=int)
 	#___________________________________________________________________________
 	#
 	def get_time(self):
 		"""
 		"""
+		if not(self.is_loaded()): self.load()
 		return self.time
 	#___________________________________________________________________________
 	#
+	def get_aggregate(self, regions):
+		"""
+		"""
+		# modules
+		import numpy as np
+		from . import profiling as pf
+		# load data on first access
+		if not(self.is_loaded()): self.load()
+		with pf.stage('aggregate'):
+			# selected regions
+			rows = self.get_rows(regions)
+			key  = rows.tobytes()
+			# sum over the selected regions (once for each set of regions), all metrics
+			if not(key in self.aggregates):
+				total = self.data[rows].sum(axis=0, dtype=np.int64)
+				self.aggregates[key] = expand_metrics(total, self.columns, self.active)
+		return key, self.aggregates[key]
+	#___________________________________________________________________________
+	#
+	def get_level(self, level=None):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# load data on first access
+		if not(self.is_loaded()): self.load()
+		# names of the regions at a level (1: coarsest, None: finest) and the
+		# index of the region of each row
+		if level is None: return self.regions, np.arange(len(self.regions))
+		names = {}
+		codes = [names.setdefault(level_separator.join(region_levels(region)[:level]), len(names))
+		         for region in self.regions]
+		return list(names.keys()), np.array(codes, dtype=int)
+	#___________________________________________________________________________
+	#
+	def get_level_data(self, level=None, metric=None):
+		"""
+		"""
+		# modules
+		import numpy as np
+		from . import profiling as pf
+		# sums of the regions at a level (regions x time x metrics, or regions x
+		# time for one metric), once for each level and metric
+		key = ('level', level, metric)
+		if not(key in self.aggregates):
+			names, codes = self.get_level(level)
+			with pf.stage('aggregate'):
+				columns = self.columns if metric is None else [metric]
+				data = select_metrics(self.data, self.columns, self.active, columns)
+				if not(level is None):
+					# rows of each region contiguous, then summed at once
+					order  = np.argsort(codes, kind='stable')
+					starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+					data = np.add.reduceat(data[order], starts, axis=0, dtype=np.int64) \
+					       if len(order) > 0 else data.astype(np.int64)
+				data = expand_metrics(data, self.columns, self.active) if metric is None else data[..., 0]
+			self.aggregates[key] = data
+		return self.aggregates[key]
+	#___________________________________________________________________________
+	#
 	def get_data_for_regions(self, regions):
 		"""
 		"""
-		# check inputs
-		if not(isinstance(regions, list)):
-			regions = list(self.confirmed.keys())
-			regions+= list(self.recovered.keys())
-			regions+= list(self.deaths.keys())
-			regions = list(set(regions))
-		# initialize output
-		confirmed = [0]*len(self.time)
-		recovered = [0]*len(self.time)
-		deaths    = [0]*len(self.time)
-		active    = [0]*len(self.time)
-		intensive = [0]*len(self.time)
-		# loop on regions
-		for region in regions:
-			if region in self.confirmed.keys():
-				for i, data in enumerate(self.confirmed[region]):
-					confirmed[i]+= data
-			else: print('WARNING! %s not found in confirmed' %(region))
-			if region in self.recovered.keys():
-				for i, data in enumerate(self.recovered[region]):
-					recovered[i]+= data
-			else: print('WARNING! %s not found in recovered' %(region))
-			if region in self.deaths.keys():
-				for i, data in enumerate(self.deaths[region]):
-					deaths[i]+= data
-			else: print('WARNING! %s not found in deaths' %(region))
-			if region in self.active.keys():
-				for i, data in enumerate(self.active[region]):
-					active[i]+= data
-			else: print('WARNING! %s not found in active' %(region))
-			if region in self.intensive.keys():
-				for i, data in enumerate(self.intensive[region]):
-					intensive[i]+= data
-			else: print('WARNING! %s not found in intensive' %(region))
+		_, total = self.get_aggregate(regions)
+		confirmed, recovered, deaths, active, intensive = total.T.copy()
 		# output
 		return confirmed, recovered, deaths, active, intensive
 	#___________________________________________________________________________
 	#
+	def get_derived(self, name, level=None, metric=None):
+		"""
+		"""
+		# modules
+		from . import profiling as pf
+		# all regions of a level at once (regions x time x metrics, or regions x
+		# metrics for the peaks; without the metrics axis for one metric),
+		# computed on first request
+		key = (name, ('level', level), metric)
+		if not(key in self.derived):
+			data = self.get_level_data(level, metric)
+			with pf.stage('derive'):
+				self.derived[key] = derive_data(data, name) if metric is None else \
+				                    derive_data(data[..., None], name)[..., 0]
+		return self.derived[key]
+	#___________________________________________________________________________
+	#
+	def get_derived_for_regions(self, name, regions):
+		"""
+		"""
+		# modules
+		from . import profiling as pf
+		# sum of the selected regions (time x metrics, or metrics for the peaks)
+		key, total = self.get_aggregate(regions)
+		if not((name, key) in self.derived):
+			with pf.stage('derive'): self.derived[(name, key)] = derive_data(total, name)
+		return self.derived[(name, key)]
+	#___________________________________________________________________________
+	#
+	def rank_regions(self, name, metric='confirmed', count=None, day=-1, level=None):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# value of each region of the level at the given day (largest first,
+		# undefined last)
+		names, _ = self.get_level(level)
+		values = self.get_derived(name, level, metric)
+		if not(name in ('peaks', 'increment_peaks')): values = values[:, day]
+		values = np.asarray(values, dtype=float)
+		order  = np.argsort(np.where(np.isnan(values), -np.inf, -values), kind='stable')
+		return [(names[i], values[i]) for i in order[:count]]
+	#___________________________________________________________________________
+	#
+
+
+
+
+################################################################################
+# Streaming
+#
+class FileLines:
+	"""
+	"""
+	def __init__(self, filename, state=None):
+		"""
+		"""
+		# store data
+		self.filename = filename
+		self.previous = state # offset and digest of the content already read
+		self.append   = False # only the lines after the offset are read
+		self.state    = None  # offset and digest of the whole file (once read)
+	#___________________________________________________________________________
+	#
+	def __iter__(self):
+		"""
+		"""
+		# modules
+		import hashlib
+		# lists of lines after the offset of the previous state (all lines if the
+		# content already read changed)
+		with open(self.filename, 'rb') as f:
+			offset = 0
+			if not(self.previous is None):
+				digest = hashlib.sha1(); n = 0
+				while n < self.previous['offset']:
+					chunk = f.read(min(chunk_size, self.previous['offset']-n))
+					if not(chunk): break
+					digest.update(chunk); n+= len(chunk)
+				if (n == self.previous['offset']) and (digest.hexdigest() == self.previous['digest']):
+					offset = n
+			if offset == 0:
+				f.seek(0); digest = hashlib.sha1()
+			self.append = offset > 0
+			# new lines (the digest is updated with the whole file)
+			for lines in iter_lines(f, digest): yield lines
+			self.state = {'offset': f.tell(), 'digest': digest.hexdigest()}
+	#___________________________________________________________________________
+	#
+
+
+
+
+class Accumulator:
+	"""
+	"""
+	def __init__(self, ncell):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# store data
+		self.regions = {} # region: row
+		self.stamps  = {} # 'YYYY-MM-DD': column
+		self.data    = np.zeros((0, 0, ncell), dtype=storage_dtype)
+		self.present = np.zeros((0, 0), dtype=bool) # cells given by some line
+	#___________________________________________________________________________
+	#
+	def add_stamps(self, stamps):
+		"""
+		"""
+		# time-stamps without data (e.g. of regions not selected)
+		for stamp in set(stamps): self.stamps.setdefault(stamp, len(self.stamps))
+	#___________________________________________________________________________
+	#
+	def add(self, regions, stamps, values, ufunc=None):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# rows and columns (new regions and time-stamps appended)
+		r_codes = np.array([self.regions.setdefault(region, len(self.regions)) for region in regions], dtype=int)
+		t_codes = np.array([self.stamps.setdefault(stamp, len(self.stamps)) for stamp in stamps], dtype=int)
+		self.data    = reserve(self.data,    (len(self.regions), len(self.stamps)))
+		self.present = reserve(self.present, (len(self.regions), len(self.stamps)))
+		self.present[r_codes, t_codes] = True
+		# store (the last value is kept, unless combined by ufunc)
+		if ufunc is None:
+			self.data[r_codes, t_codes] = values
+		else:
+			ufunc.at(self.data, (r_codes, t_codes), values)
+	#___________________________________________________________________________
+	#
+	def result(self):
+		"""
+		"""
+		# modules
+		import numpy as np
+		# time-stamps sorted in time
+		time, rank = index_dates(list(self.stamps.keys()))
+		values  = reserve(self.data,    (len(self.regions), len(time)))
+		present = reserve(self.present, (len(self.regions), len(time)))
+		data = np.zeros((len(self.regions), len(time), self.data.shape[2]), dtype=self.data.dtype)
+		data[:, rank] = values[:len(self.regions), :len(time)]
+		mask = np.zeros((len(self.regions), len(time)), dtype=bool)
+		mask[:, rank] = present[:len(self.regions), :len(time)]
+		return time, list(self.regions.keys()), data, mask
+	#___________________________________________________________________________
+	#
 
 
 
@@ -122,182 +711,642 @@ class RawData:
 # Support functions
 #_______________________________________________________________________________
 #
-def read_data_jhu(rawdata):
+def load_all(rawdatas, max_workers=None):
+	"""
+	"""
+	# modules
+	from concurrent.futures import ThreadPoolExecutor
+	# pull and read each data-set in its own thread (git runs in subprocesses)
+	if len(rawdatas) == 0: return rawdatas
+	with ThreadPoolExecutor(max_workers=max_workers or len(rawdatas)) as executor:
+		futures = [executor.submit(rawdata.load) for rawdata in rawdatas]
+		for future in futures: future.result()
+	return rawdatas
+#_______________________________________________________________________________
+#
+def register_format(name, schema):
+	"""
+	"""
+	# check the schema (a wrong schema must not silently misparse)
+	schema = dict(schema)
+	if not(schema.get('layout') in ('long', 'wide')):
+		raise ValueError('format %s: unknown layout %s' %(name, schema.get('layout')))
+	required = ['files', 'region', 'date'] + (['metrics'] if schema['layout'] == 'long' else [])
+	for k in required:
+		if not(k in schema): raise ValueError('format %s: missing %s' %(name, k))
+	declared = schema['files'] if schema['layout'] == 'wide' else schema['metrics']
+	for metric in declared:
+		if not(metric in metrics): raise ValueError('format %s: unknown metric %s' %(name, metric))
+	if not(schema.get('combine') in (None, 'max', 'sum')):
+		raise ValueError('format %s: unknown combine %s' %(name, schema['combine']))
+	schema.setdefault('dirs', [])
+	formats[name] = schema
+	return schema
+#_______________________________________________________________________________
+#
+def get_format(name):
+	"""
+	"""
+	if not(name in formats): raise ValueError('unknown data format %s' %(name))
+	return formats[name]
+#_______________________________________________________________________________
+#
+def compile_schema(schema, header):
+	"""
+	"""
+	# modules
+	import re
+	import json
+	import operator
+	import datetime as dt
+	# once for each schema and header
+	key = (json.dumps(schema, sort_keys=True), header)
+	if key in compiled: return compiled[key]
+	columns = header.split(',')
+	def column(names):
+		names = [names] if isinstance(names, str) else names
+		for name in names:
+			if name in columns: return columns.index(name)
+		raise ValueError('missing column %s' %(' or '.join(names)))
+	regions = [schema['region']] if isinstance(schema['region'], str) else schema['region']
+	parser = {'ncol': len(columns), 'region': [column(region) for region in regions]}
+	if schema['layout'] == 'wide':
+		# dates: the header columns parsed by the date format
+		dates = []
+		for i, name in enumerate(columns):
+			try: dt.datetime.strptime(name, schema['date']); dates.append(i)
+			except ValueError: pass
+		if len(dates) == 0: raise ValueError('no date column (%s)' %(schema['date']))
+		if dates != list(range(dates[0], len(columns))): raise ValueError('date columns not at the end')
+		parser['leading'] = dates[0]
+	else:
+		# date, stored metrics (columns parsed at once) and filters
+		parser['date'] = column(schema['date'])
+		index = [column(schema['metrics'][metric]) for metric in stored_metrics(schema)]
+		parser['values']  = operator.itemgetter(*index) if len(index) > 1 else \
+		                    (lambda row, i=index[0]: (row[i],))
+		parser['filters'] = [(column(name), re.compile('|'.join([re.escape(value) for value in values])).search)
+		                     for name, values in schema.get('filters', {}).items()]
+		parser['width']   = max(parser['region'] + [parser['date']] + index +
+		                        [i for i, _ in parser['filters']]) + 1
+	compiled[key] = parser
+	return parser
+#_______________________________________________________________________________
+#
+def read_header(filename):
+	"""
+	"""
+	with open(filename, 'rb') as f: header = f.readline().decode('utf-8').strip()
+	if not(header): raise ValueError('%s: missing header' %(filename))
+	return header
+#_______________________________________________________________________________
+#
+def read_data_long(rawdata, schema, state=None):
+	"""
+	"""
+	# modules
+	import os
+	import numpy as np
+	# time-series file and its parser
+	filename = schema['files']
+	timeseries_file = os.path.join(rawdata.path, *filename.split('/'))
+	try:
+		parser = compile_schema(schema, read_header(timeseries_file))
+	except ValueError as e:
+		raise ValueError('%s: %s' %(timeseries_file, e))
+	ir, it, width = parser['region'], parser['date'], parser['width']
+	ncol  = len(stored_metrics(schema))
+	ufunc = {'max': np.maximum, 'sum': np.add}.get(schema.get('combine'))
+	# read new lines (all if no valid state)
+	files = state['files'] if not(state is None) else {}
+	stream = FileLines(timeseries_file, files.get(filename))
+	selection = rawdata.get_selection()
+	accumulator = Accumulator(ncol)
+	header = True
+	for lines in stream:
+		# skip header
+		if header and not(stream.append): lines = lines[1:]
+		header = False
+		# apply the filters (to the whole line first, to split only the candidate
+		# lines) and split lines (malformed lines are skipped)
+		for _, search in parser['filters']: lines = [l for l in lines if search(l)]
+		rows = [row for row in [l.split(',') for l in lines] if len(row) >= width]
+		for i, search in parser['filters']: rows = [row for row in rows if search(row[i])]
+		# keep the time-stamps of all lines, the data of the selected regions
+		accumulator.add_stamps([row[it][:10] for row in rows])
+		names = [region_name([row[i] for i in ir]) for row in rows]
+		if not(selection is None):
+			keep  = [i for i, name in enumerate(names) if is_selected(name, selection)]
+			rows  = [rows[i] for i in keep]
+			names = [names[i] for i in keep]
+		if len(rows) == 0: continue
+		# data (stored metrics parsed at once, time truncated to the day)
+		get = parser['values']
+		values = parse_int_block([','.join(get(row)) for row in rows], ncol)
+		accumulator.add(names, [row[it][:10] for row in rows], values, ufunc)
+	state = {'append': stream.append, 'files': {filename: stream.state}}
+	# output (stored metrics only)
+	time, regions, data, present = accumulator.result()
+	return time, regions, data, present, state
+#_______________________________________________________________________________
+#
+def read_data_wide(rawdata, schema, state=None):
 	"""
 	"""
 	# modules
 	import os
-	# path to time-series files
-	timeseries_path = os.path.join(rawdata.path, 'csse_covid_19_data', 'csse_covid_19_time_series')
-	# read confirmed cases
-	timeseries_file = os.path.join(timeseries_path, 'time_series_19-covid-Confirmed.csv')
-	time, confirmed = read_file_jhu(timeseries_file)
-	# read recovered cases
-	timeseries_file = os.path.join(timeseries_path, 'time_series_19-covid-Recovered.csv')
-	time, recovered = read_file_jhu(timeseries_file)
-	# read deaths
-	timeseries_file = os.path.join(timeseries_path, 'time_series_19-covid-Deaths.csv')
-	time, deaths = read_file_jhu(timeseries_file)
-	# compute active cases (and dummy intensive care)
-	active = {}; intensive = {}
-	for region in confirmed.keys():
-		active[region]    = [0]*len(confirmed[region])
-		intensive[region] = [0]*len(confirmed[region])
-		for i in range(len(confirmed[region])):
-			active[region][i] = confirmed[region][i]
-			active[region][i]-= recovered[region][i] + deaths[region][i]
+	import numpy as np
+	# read files (only the new dates if state is given)
+	files = state['files'] if not(state is None) else {}
+	selection = rawdata.get_selection()
+	columns = stored_metrics(schema)
+	data_by_metric = {}; new_files = {}; append = True
+	for metric in columns:
+		filename = schema['files'][metric]
+		timeseries_file = os.path.join(rawdata.path, *filename.split('/'))
+		*data_by_metric[metric], new_files[filename], appended = \
+			read_file_wide(timeseries_file, schema, files.get(filename), selection)
+		append = append & appended
+	# some file changed before the new dates: re-read all
+	if not(append) and not(state is None):
+		return read_data_wide(rawdata, schema)
+	# collect regions (time-stamps from the first file)
+	time = data_by_metric[columns[0]][0]
+	index = {}
+	for metric in columns:
+		for region in data_by_metric[metric][1]:
+			if not(region in index): index[region] = len(index)
+	regions = list(index.keys())
+	# fill array (stored metrics only)
+	data = np.zeros((len(regions), len(time), len(columns)), dtype=storage_dtype)
+	for j, metric in enumerate(columns):
+		_, metric_regions, values = data_by_metric[metric]
+		rows = [index[region] for region in metric_regions]
+		ntime = min(len(time), values.shape[1])
+		data[rows, :ntime, j] = values[:, :ntime]
+		del data_by_metric[metric]
+	# output (all cells of the new dates given)
+	state = {'append': append, 'files': new_files}
+	return time, regions, data, None, state
+#_______________________________________________________________________________
+#
+def read_file_wide(filename, schema, state=None, selection=None):
+	"""
+	"""
+	# modules
+	import hashlib
+	import numpy as np
+	# digest of the whole file and of the columns already read
+	digest = hashlib.sha1(); old_digest = hashlib.sha1()
+	# regions (rows of the same region are summed) and their sums
+	index = {}
+	data  = np.zeros((0, 0), dtype=storage_dtype); nrow = 0
+	# read file in chunks of lines
+	header = None
+	with open(filename, 'rb') as f:
+		for lines in iter_lines(f):
+			# read header (time-stamps)
+			if header is None:
+				header = lines.pop(0)
+				try:
+					parser = compile_schema(schema, header)
+				except ValueError as e:
+					raise ValueError('%s: %s' %(filename, e))
+				leading, ir = parser['leading'], parser['region']
+				line = header.split(',')
+				ncol = len(line)-leading
+				# number of new dates (all if no valid state)
+				append = not(state is None) and (state['ncol'] <= ncol)
+				nnew = ncol - state['ncol'] if append else ncol
+				nold = ncol - nnew
+				time = parse_dates(line[len(line)-nnew:], schema['date'])
+				digest.update((header + '\n').encode())
+				if append:
+					old_header = header.rsplit(',', nnew)[0] if nnew > 0 else header
+					old_digest.update((old_header + '\n').encode())
+				data = np.zeros((0, nnew), dtype=storage_dtype)
+			if len(lines) == 0: continue
+			digest.update(('\n'.join(lines) + '\n').encode())
+			# split region columns and new data columns
+			rows = [split_row_wide(l, leading+nold, nnew) for l in lines]
+			if append: old_digest.update(('\n'.join([row[0] for row in rows]) + '\n').encode())
+			# keep the selected regions only
+			names = [region_wide(row[0], ir) for row in rows]
+			keep  = [i for i, name in enumerate(names) if (selection is None) or is_selected(name, selection)]
+			if len(keep) == 0: continue
+			codes = [index.setdefault(names[i], len(index)) for i in keep]
+			# parse numeric block and sum by region
+			values = parse_int_block([rows[i][1] for i in keep], nnew)
+			data = reserve(data, (len(index), nnew))
+			if len(set(codes)) == len(codes):
+				data[codes]+= values # one row for each region (no unbuffered sum)
+			else:
+				np.add.at(data, np.array(codes, dtype=int), values)
+	# empty file
+	if header is None: raise ValueError('%s: missing header' %(filename))
+	if append: append = (old_digest.hexdigest() == state['digest'])
 	# output
-	return time, confirmed, recovered, deaths, active, intensive
+	state = {'ncol': ncol, 'digest': digest.hexdigest()}
+	return time, list(index.keys()), data[:len(index)], state, append
+#_______________________________________________________________________________
+#
+def split_row_wide(l, nlead, nnew):
+	"""
+	"""
+	# from the left (faster for large nnew, only if no quoted region name)
+	if (nlead <= nnew) and not('"' in l):
+		i = -1
+		for _ in range(nlead):
+			i = l.find(',', i+1)
+			if i < 0: return l, ''
+		return l[:i], l[i+1:]
+	# from the right
+	if nnew == 0: return l, ''
+	row = l.rsplit(',', nnew)
+	return row[0], ','.join(row[1:])
+#_______________________________________________________________________________
+#
+def region_wide(prefix, ir):
+	"""
+	"""
+	# modules
+	import csv
+	# quoted names may hold commas
+	if '"' in prefix:
+		row = next(csv.reader([prefix]))
+	else:
+		row = prefix.split(',', max(ir)+1)
+	return region_name([row[i] for i in ir])
 #_______________________________________________________________________________
 #
-def read_file_jhu(filename):
+def parse_dates(stamps, fmt):
 	"""
 	"""
 	# modules
 	import datetime as dt
-	# open file
-	f = open(filename, 'r')
-	# read header (time-stamps)
-	line = f.readline().rstrip('\r\n').split(',')
-	time = [dt.datetime.strptime(t, '%m/%d/%y') for t in line[4:]]
-	# loop on entries
-	data_by_region={}
-	for l in f:
-		# split line
-		line = l.rstrip('\r\n').rsplit(',', len(time)+3)
-		# get region
-		region = line[1]
-		# initialize region if needed
-		if not(region in data_by_region.keys()):
-			data_by_region[region] = [0]*len(time)
-		# add data to region
-		for i, data in enumerate(line[4:]):
-			try: data_by_region[region][i]+= int(data)
-			except: data_by_region[region][i]+= 0
-	# output
-	return time, data_by_region
+	# month/day/two-digit year parsed directly (many columns)
+	if fmt != '%m/%d/%y':
+		return [dt.datetime.strptime(stamp, fmt) for stamp in stamps]
+	time = []
+	for stamp in stamps:
+		m, d, y = [int(s) for s in stamp.split('/')]
+		time.append(dt.datetime(y + 2000 if y < 69 else y + 1900 if y < 100 else y, m, d))
+	return time
 #_______________________________________________________________________________
 #
-def read_data_dpc(rawdata):
+def parse_int_cells(cells):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# blank and malformed cells are set to zero
+	cells  = np.char.strip(cells)
+	digits = np.char.lstrip(cells, '+-')
+	valid  = np.char.isdigit(digits) & (np.char.str_len(cells) - np.char.str_len(digits) <= 1)
+	values = np.zeros(cells.shape, dtype=np.int64)
+	values[valid] = cells[valid].astype(np.int64)
+	return values
+#_______________________________________________________________________________
+#
+def fill_calendar(time, data):
 	"""
 	"""
 	# modules
-	import os
 	import datetime as dt
-	# path to time-series files
-	timeseries_path = os.path.join(rawdata.path, 'dati-regioni')
-	# read confirmed cases
-	timeseries_file = os.path.join(timeseries_path, 'dpc-covid19-ita-regioni.csv')
-	# initilize output
-	time      = []
-	confirmed = {}
-	recovered = {}
-	deaths    = {}
-	active    = {}
-	intensive = {}
-	# open file
-	f = open(timeseries_file, 'r')
-	# skip header
-	f.readline()
-	# loop on entries
-	for l in f:
-		# split line
-		line = l.rstrip('\r\n').rsplit(',')
-		# get time
-		t = dt.datetime.strptime(line[0], '%Y-%m-%d %H:%M:%S')
-		t = dt.datetime(*t.timetuple()[:3])
-		if not(t in time): time.append(t)
-		# get region name
-		region = line[3]
-		# get confirmed
-		if not(region in confirmed.keys()): confirmed[region]=[0]*(len(time)-1)
-		confirmed[region]+= [int(line[14])]
-		# get recovered
-		if not(region in recovered.keys()): recovered[region]=[0]*(len(time)-1)
-		recovered[region]+= [int(line[12])]
-		# get deaths
-		if not(region in deaths.keys()): deaths[region]=[0]*(len(time)-1)
-		deaths[region]+= [int(line[13])]
-		# get active
-		if not(region in active.keys()): active[region]=[0]*(len(time)-1)
-		active[region]+= [int(line[10])]
-		# get intensive
-		if not(region in intensive.keys()): intensive[region]=[0]*(len(time)-1)
-		intensive[region]+= [int(line[7])]
-	# output
-	return time, confirmed, recovered, deaths, active, intensive
+	import numpy as np
+	# continuous daily calendar from the first to the last day: the days not
+	# found in the files get empty cells (filled and masked by clean_data)
+	if len(time) == 0: return list(time), data
+	days = np.array([(t - time[0]).days for t in time], dtype=int)
+	if days[-1] == len(days) - 1: return list(time), data
+	data = np.asarray(data)
+	full = np.zeros((data.shape[0], days[-1] + 1) + data.shape[2:], dtype=data.dtype)
+	full[:, days] = data
+	return [time[0] + dt.timedelta(days=int(day)) for day in range(days[-1] + 1)], full
 #_______________________________________________________________________________
 #
-def read_data_ofr(rawdata):
+def clean_data(data, columns=metrics):
+	"""
+	"""
+	# modules
+	import numpy as np
+	data = np.array(data, dtype=storage_dtype)
+	nregion, ntime, _ = data.shape
+	cumulative = [columns.index(metric) for metric in ('confirmed', 'recovered', 'deaths') if metric in columns]
+	masks = {}
+	# missing days: nothing reported after the first report (filled with the
+	# last reported day)
+	reported = np.any(data != 0, axis=2)
+	missing  = np.logical_or.accumulate(reported, axis=1) & ~reported
+	if np.any(missing):
+		last = np.maximum.accumulate(np.where(reported, np.arange(ntime), 0), axis=1)
+		data = np.take_along_axis(data, last[:, :, None], axis=1)
+	masks['missing'] = missing
+	# cumulative data cannot decrease (downward corrections are raised)
+	values = data[:, :, cumulative]
+	fixed  = np.maximum.accumulate(values, axis=1)
+	masks['corrected'] = np.zeros(data.shape, dtype=bool)
+	masks['corrected'][:, :, cumulative] = fixed > values
+	data[:, :, cumulative] = fixed
+	# outliers: daily increments far above the mean of the previous week
+	increments = np.diff(fixed, axis=1, prepend=fixed[:, :1])
+	week = np.zeros(fixed.shape)
+	week[:, 8:] = (fixed[:, 7:-1] - fixed[:, :-8])/7.
+	masks['outliers'] = np.zeros(data.shape, dtype=bool)
+	masks['outliers'][:, 8:, cumulative] = ((increments > outlier_factor*np.maximum(week, 1.)) &
+	                                        (increments > outlier_min))[:, 8:]
+	return data, masks
+#_______________________________________________________________________________
+#
+def derive_data(data, name):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# cumulative data along the last but one axis (... x time x metrics)
+	data = np.asarray(data)
+	w = rolling_window
+	# daily increments (none the first day)
+	if name == 'increments':
+		return np.diff(data, axis=-2, prepend=data[..., :1, :])
+	# rolling mean of the increments (over the available days at the beginning)
+	if name == 'mean':
+		total = np.zeros(data.shape)
+		total[..., w:, :] = data[..., w:, :] - data[..., :-w, :]
+		total[..., :w, :] = data[..., :w, :] - data[..., :1, :]
+		return total/np.minimum(np.arange(data.shape[-2]), w)[:, None].clip(1)
+	# daily growth rate (increment over the previous day)
+	if name == 'growth':
+		growth = np.full(data.shape, np.nan)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			growth[..., 1:, :] = (data[..., 1:, :] - data[..., :-1, :])/data[..., :-1, :].astype(float)
+		return growth
+	# doubling time in days over the last window (inf without growth)
+	if name == 'doubling':
+		doubling = np.full(data.shape, np.nan)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			rate = np.log(data[..., w:, :]/data[..., :-w, :].astype(float))
+			rate[~np.isfinite(rate)] = np.nan # nothing a window before
+			doubling[..., w:, :] = np.where(rate > 0., w*np.log(2.)/rate,
+			                                np.where(np.isnan(rate), np.nan, np.inf))
+		return doubling
+	# day of the maximum of each metric (of the data or of the increments)
+	if name == 'peaks':
+		return np.argmax(data, axis=-2)
+	if name == 'increment_peaks':
+		return np.argmax(derive_data(data, 'increments'), axis=-2)
+	raise ValueError('unknown derived metric %s' %(name))
+#_______________________________________________________________________________
+#
+def stored_metrics(schema):
+	"""
+	"""
+	# metrics read from the files (not the derived active cases)
+	declared = schema['files'] if schema['layout'] == 'wide' else schema['metrics']
+	return tuple([metric for metric in metrics if (metric in declared) and
+	              not((metric == 'active') and schema.get('active', False))])
+#_______________________________________________________________________________
+#
+def select_metrics(data, columns, active, selected):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# stored, derived (active cases) or missing (zero) metrics of the data
+	selected = [metric for metric in selected]
+	if all([metric in columns for metric in selected]):
+		return data[..., [columns.index(metric) for metric in selected]]
+	out = np.zeros(data.shape[:-1] + (len(selected),), dtype=np.int64)
+	for j, metric in enumerate(selected):
+		if metric in columns:
+			out[..., j] = data[..., columns.index(metric)]
+		elif (metric == 'active') and active:
+			out[..., j] = select_metrics(data, columns, False, ['confirmed', 'recovered', 'deaths']) \
+			              .astype(np.int64).dot([1, -1, -1])
+	return out
+#_______________________________________________________________________________
+#
+def expand_metrics(data, columns, active=False):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# all metrics (as int64, the active cases after summing the regions)
+	return np.asarray(select_metrics(data, columns, active, metrics), dtype=np.int64)
+#_______________________________________________________________________________
+#
+def region_name(levels):
+	"""
+	"""
+	# from the coarsest to the finest level (blank levels are skipped, and the
+	# separators inside a level escaped, e.g. 'Fuori Regione \/ Provincia Autonoma')
+	return level_separator.join([level.replace('\\', '\\\\').replace(level_separator, '\\' + level_separator)
+	                             for level in levels if level])
+#_______________________________________________________________________________
+#
+def region_levels(region):
+	"""
+	"""
+	# modules
+	import re
+	# levels of a region name (escaped as in the name)
+	if not('\\' in region): return region.split(level_separator)
+	return re.findall(r'(?:\\.|[^\\%s])+' %(re.escape(level_separator)), region)
+#_______________________________________________________________________________
+#
+def region_keys(region):
+	"""
+	"""
+	# modules
+	import re
+	# names of the region and of its parents (e.g. 'US' and 'US/New York'), and
+	# of its levels (e.g. 'New York', unescaped)
+	levels = region_levels(region)
+	prefixes = [level_separator.join(levels[:k]) for k in range(1, len(levels)+1)]
+	if '\\' in region: levels = [re.sub(r'\\(.)', r'\1', level) for level in levels]
+	return prefixes, levels
+#_______________________________________________________________________________
+#
+def is_selected(region, selection):
+	"""
+	"""
+	if region in selection: return True
+	prefixes, levels = region_keys(region)
+	return any([key in selection for key in prefixes + levels])
+#_______________________________________________________________________________
+#
+def index_regions(regions):
+	"""
+	"""
+	# rows of each region and of each parent region (by qualified name), then
+	# of the levels named without their parents (unless a qualified name),
+	# only if the name stands for a single qualified name: otherwise it is
+	# ambiguous (e.g. the state and the county 'Washington')
+	index = {}; levels = {}
+	for i, region in enumerate(regions):
+		prefixes, names = region_keys(region)
+		for key in prefixes: index.setdefault(key, []).append(i)
+		for key, name in zip(prefixes[1:], names[1:]):
+			levels.setdefault(name, {}).setdefault(key, []).append(i)
+	ambiguous = {}
+	for name, keys in levels.items():
+		if name in index: continue
+		if len(keys) == 1:
+			index[name] = list(keys.values())[0]
+		else:
+			ambiguous[name] = sorted(keys.keys())
+	return index, ambiguous
+#_______________________________________________________________________________
+#
+def index_keys(keys):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# unique keys (in order of appearance) and index of each entry
+	index = {}
+	codes = [index.setdefault(key, len(index)) for key in keys]
+	return list(index.keys()), np.array(codes, dtype=int)
+#_______________________________________________________________________________
+#
+def index_dates(stamps):
 	"""
 	"""
 	# modules
-	import os
 	import datetime as dt
-	# path to time-series files
-	timeseries_path = os.path.join(rawdata.path, 'dist')
-	# read confirmed cases
-	timeseries_file = os.path.join(timeseries_path, 'chiffres-cles.csv')
-	# initilize output
-	time      = []
-	confirmed = {}
-	recovered = {}
-	deaths    = {}
-	active    = {}
-	intensive = {}
-	# open file
-	f = open(timeseries_file, 'r')
-	# skip header
-	f.readline()
-	# loop on entries
-	for l in f:
-		# split line
-		line = l.rstrip('\r\n').rsplit(',')
-		line = ['0' if c == '' else c for c in line]
-		if ('REG' in line[2])|('FRA' in line[2]):
-			if ('et de la Sant' in line[9])|('ARS' in line[9]):
-				# get time
-				t = dt.datetime.strptime(line[0], '%Y-%m-%d')
-				t = dt.datetime(*t.timetuple()[:3])
-				if not(t in time): time.append(t)
-				# get region name
-				region = line[3]
-				# get confirmed
-				if not(region in confirmed.keys()): confirmed[region]=[]
-				confirmed[region]+= [0]*(len(time)-len(confirmed[region])-1)
-				confirmed[region]+= [int(line[4])]
-				# get deaths
-				if not(region in deaths.keys()): deaths[region]=[]
-				deaths[region]+= [0]*(len(time)-len(deaths[region])-1)
-				deaths[region]+= [int(line[5])]
-				# get intensive
-				if not(region in intensive.keys()): intensive[region]=[]
-				intensive[region]+= [0]*(len(time)-len(intensive[region])-1)
-				intensive[region]+= [int(line[6])]
-				# get recovered
-				if not(region in recovered.keys()): recovered[region]=[]
-				recovered[region]+= [0]*(len(time)-len(recovered[region])-1)
-				recovered[region]+= [int(line[8])]
-				# initialize active
-				if not(region in active.keys()): active[region]=[]
-	# fix_data
-	fix_data_ofr(time, confirmed)
-	fix_data_ofr(time, deaths)
-	fix_data_ofr(time, recovered)
-	# compute active
-	for region, data in active.iteritems():
-		active[region] = [c-r-d for c, r, d in zip(confirmed[region], deaths[region],  recovered[region])]
+	import numpy as np
+	# parse each distinct 'YYYY-MM-DD' stamp once
+	stamps, codes = index_keys(stamps)
+	time = [dt.datetime.strptime(stamp, '%Y-%m-%d') for stamp in stamps]
+	# sort in time
+	order = np.argsort(np.array(time, dtype='datetime64[us]'), kind='stable')
+	rank  = np.empty(len(order), dtype=int); rank[order] = np.arange(len(order))
+	return [time[i] for i in order], rank[codes]
+#_______________________________________________________________________________
+#
+def parse_int_block(rows, ncell):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# parse all rows in one call (blank cells set to zero), if all of them have
+	# the expected number of cells (ragged rows would shift the next ones)
+	values = np.array([])
+	if all([row.count(',') == ncell-1 for row in rows]):
+		block = (',' + ','.join(rows) + ',').replace(',,', ',0,').replace(',,', ',0,')
+		try: values = np.fromstring(block[1:-1], dtype=np.int64, sep=',')
+		except ValueError: pass
+	# malformed or missing cells: parse cell by cell
+	if values.size != len(rows)*ncell:
+		cells = [(row.split(',') + ['']*ncell)[:ncell] if ncell > 0 else [] for row in rows]
+		values = parse_int_cells(np.array(cells, dtype=str).reshape(len(rows), ncell))
+	return values.reshape(len(rows), ncell)
+#_______________________________________________________________________________
+#
+def merge_data(time, regions, data, new_time, new_regions, new_data, present=None, combine=None):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# union of time-stamps and regions
+	time = list(time); regions = list(regions)
+	time_index = dict((t, i) for i, t in enumerate(time))
+	for t in new_time:
+		if not(t in time_index): time_index[t] = len(time); time.append(t)
+	region_index = dict((region, i) for i, region in enumerate(regions))
+	for region in new_regions:
+		if not(region in region_index): region_index[region] = len(regions); regions.append(region)
+	# merged array (the cells given by the new lines override the old ones, or
+	# are combined with them as the lines of the same day)
+	merged = np.zeros((len(regions), len(time), data.shape[2]), dtype=data.dtype)
+	merged[:data.shape[0], :data.shape[1]] = data
+	rows = [region_index[region] for region in new_regions]
+	cols = [time_index[t] for t in new_time]
+	block = merged[np.ix_(rows, cols)]
+	if combine == 'max': new_data = np.maximum(block, new_data)
+	if combine == 'sum': new_data = block + new_data
+	if not(present is None): new_data = np.where(present[..., None], new_data, block)
+	merged[np.ix_(rows, cols)] = new_data
+	# sort in time
+	order = np.argsort(np.array(time, dtype='datetime64[us]'), kind='stable')
+	time = [time[i] for i in order]
 	# output
-	return time, confirmed, recovered, deaths, active, intensive
+	return time, regions, merged[:, order]
 #_______________________________________________________________________________
 #
-def fix_data_ofr(time, data_dict):
-	for region, data in data_dict.iteritems():
-		for i, point in enumerate(data):
-			if i == 0: mindata = point
-			elif point < mindata:
-				data_dict[region][i]=mindata
-			else: mindata = point
-	return data
+def iter_lines(f, digest=None):
+	"""
+	"""
+	# non-empty lines of a binary file, in lists of about `chunk_size` bytes
+	# (a partial last line is carried to the next chunk)
+	rest = b''
+	while True:
+		chunk = f.read(chunk_size)
+		if not(chunk): break
+		if not(digest is None): digest.update(chunk)
+		chunk = rest + chunk
+		end  = chunk.rfind(b'\n') + 1
+		rest = chunk[end:]
+		lines = [l for l in chunk[:end].decode('utf-8').splitlines() if l]
+		if lines: yield lines
+	lines = [l for l in rest.decode('utf-8').splitlines() if l]
+	if lines: yield lines
+#_______________________________________________________________________________
+#
+def reserve(data, shape):
+	"""
+	"""
+	# modules
+	import numpy as np
+	# array holding at least `shape` on the first axes (capacity doubled, the
+	# extra entries are zero)
+	size = data.shape[:len(shape)]
+	if all([n <= m for n, m in zip(shape, size)]): return data
+	new_size = [m if n <= m else max(n, 2*m) for n, m in zip(shape, size)]
+	grown = np.zeros(tuple(new_size) + data.shape[len(shape):], dtype=data.dtype)
+	grown[tuple(slice(0, m) for m in size)] = data
+	return grown
+#_______________________________________________________________________________
+#
+def save_cache(filename, key, head, state, time, regions, data):
+	"""
+	"""
+	# modules
+	import os
+	import json
+	import numpy as np
+	# write to a temporary file first (never leave a truncated cache)
+	tmpname = filename + '.tmp'
+	with open(tmpname, 'wb') as f:
+		np.savez(f, key=np.array(key), head=np.array(head),
+		            state=np.array(json.dumps(state)),
+		            time=np.array(time, dtype='datetime64[D]'),
+		            regions=np.array(regions, dtype=str),
+		            data=data)
+	os.replace(tmpname, filename)
+#_______________________________________________________________________________
+#
+def load_cache(filename):
+	"""
+	"""
+	# modules
+	import os
+	import json
+	import numpy as np
+	# no cache yet
+	if not(os.path.isfile(filename)): return None
+	# read arrays (a corrupted cache is simply ignored)
+	try:
+		with np.load(filename, allow_pickle=False) as f:
+			cached = {'key'    : str(f['key']),
+			          'head'   : str(f['head']),
+			          'state'  : json.loads(str(f['state'])),
+			          'time'   : list(f['time'].astype('datetime64[us]').astype(object)),
+			          'regions': [str(region) for region in f['regions']],
+			          'data'   : f['data']}
+	except (OSError, ValueError, KeyError):
+		return None
+	# output
+	return cached
 #_______________________________________________________________________________
 #
@@ -0,0 +1,206 @@
+##############################################################################80
+#                                                                              #
+#                                 Figure Server                                #
+#                                                                              #
+# (2020) Nicolo Fabbiane                                                       #
+#                                                                              #
+################################################################################
+
+# Minimal HTTP server (standard library only) answering the requests of the
+# figures and data of the resident data-sets. The responses are kept in an
+# LRU cache, invalidated for the data-sets whose data changed at a refresh.
+#
+#   GET /                                      data-sets (JSON)
+#   GET /<data_set>                            regions, groups and figures (JSON)
+#   GET /<data_set>/figure.png?region=A&region=B&title=T
+#   GET /<data_set>/figure.json?region=A&region=B
+#   GET /<data_set>/figure.png?figure=<name>   figure declared by the data-set
+#
+# Without region nor figure, the whole data-set is selected. Unknown regions
+# (or a selection without any region in the data) are answered with 404.
+
+
+################################################################################
+# LRU cache
+#
+class LRUCache:
+	"""
+	"""
+	def __init__(self, maxsize=128):
+		"""
+		"""
+		# modules
+		import threading
+		from collections import OrderedDict
+		# store data
+		self.maxsize = maxsize
+		self.entries = OrderedDict()
+		self.lock    = threading.Lock()
+		self.hits    = 0
+		self.misses  = 0
+	#___________________________________________________________________________
+	#
+	def get(self, key):
+		"""
+		"""
+		with self.lock:
+			if not(key in self.entries):
+				self.misses+= 1
+				return None
+			self.hits+= 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+	#___________________________________________________________________________
+	#
+	def put(self, key, value):
+		"""
+		"""
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			# drop the least recently used entries
+			while len(self.entries) > self.maxsize: self.entries.popitem(last=False)
+	#___________________________________________________________________________
+	#
+	def invalidate(self, data_sets):
+		"""
+		"""
+		# entries are keyed by (data_set, ...)
+		with self.lock:
+			for key in [key for key in self.entries if key[0] in data_sets]:
+				del self.entries[key]
+	#___________________________________________________________________________
+	#
+
+
+
+
+################################################################################
+# Server
+#
+class FigureServer:
+	"""
+	"""
+	def __init__(self, data_sets, render, series, describe, resolve, reload, refresh,
+	             interval=None, maxsize=128):
+		"""
+		"""
+		# modules
+		import threading
+		# store data
+		self.data_sets = list(data_sets)
+		self.render    = render   # (data_set, title, regions) -> PNG bytes
+		self.series    = series   # (data_set, regions) -> JSON-able dict
+		self.describe  = describe # (data_set) -> JSON-able dict
+		self.resolve   = resolve  # (data_set, regions) -> (unknown regions, number of rows)
+		self.reload    = reload   # () -> new data (pulled and read, not served yet)
+		self.refresh   = refresh  # (new data) -> data-sets whose data changed
+		self.interval  = interval # minutes between refreshes (None: never)
+		self.cache     = LRUCache(maxsize)
+		self.lock      = threading.Lock() # data and figures used by one request at a time
+		self.stopped   = threading.Event()
+	#___________________________________________________________________________
+	#
+	def handle(self, path, query):
+		"""
+		"""
+		# modules
+		import json
+		from urllib.parse import unquote
+		# route
+		parts = [unquote(part) for part in path.split('/') if part]
+		if len(parts) == 0:
+			return 200, 'application/json', json.dumps(self.data_sets).encode()
+		data_set = parts[0]
+		if not(data_set in self.data_sets):
+			return 404, 'text/plain', ('unknown data-set %s\n' %(data_set)).encode()
+		if len(parts) == 1:
+			with self.lock: body = json.dumps(self.describe(data_set)).encode()
+			return 200, 'application/json', body
+		if (len(parts) > 2) or not(parts[1] in ('figure.png', 'figure.json')):
+			return 404, 'text/plain', ('unknown resource %s\n' %(path)).encode()
+		# selected regions (a declared figure, a list of regions or all)
+		if 'figure' in query:
+			with self.lock: description = self.describe(data_set)
+			title = query['figure'][0]
+			if not(title in description['figures']):
+				return 404, 'text/plain', ('unknown figure %s\n' %(title)).encode()
+			regions = description['figures'][title]
+		else:
+			regions = query.get('region', None)
+			title   = query.get('title', [', '.join(regions) if regions else data_set])[0]
+		# cached response
+		fmt = parts[1].split('.')[1]
+		key = (data_set, fmt, title, None if regions is None else tuple(regions))
+		cached = self.cache.get(key)
+		if not(cached is None): return cached
+		# compute response (stored before a refresh can invalidate it)
+		with self.lock:
+			unknown, nrows = self.resolve(data_set, regions)
+			# a declared figure may miss some of its regions, not a query
+			if (nrows == 0) or ((len(unknown) > 0) and not('figure' in query)):
+				return 404, 'text/plain', ('unknown region %s\n' %(', '.join(unknown or regions or []))).encode()
+			if fmt == 'png':
+				response = 200, 'image/png', self.render(data_set, title, regions)
+			else:
+				response = 200, 'application/json', json.dumps(self.series(data_set, regions)).encode()
+			self.cache.put(key, response)
+		return response
+	#___________________________________________________________________________
+	#
+	def refresh_loop(self):
+		"""
+		"""
+		# pull and read the data every `interval` minutes
+		while not(self.stopped.wait(self.interval*60.)):
+			try:
+				# requests are served from the previous data meanwhile
+				data = self.reload()
+				with self.lock:
+					changed = self.refresh(data)
+					self.cache.invalidate(changed)
+			except Exception as e:
+				# keep serving the previous data
+				print('WARNING! refresh failed: %s' %(e))
+				continue
+			if len(changed) > 0: print('refreshed %s' %(', '.join(changed)))
+	#___________________________________________________________________________
+	#
+	def serve_forever(self, host='127.0.0.1', port=8000):
+		"""
+		"""
+		# modules
+		import threading
+		from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+		from urllib.parse import urlsplit, parse_qs
+		app = self
+		# request handler
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				url = urlsplit(self.path)
+				try:
+					status, content_type, body = app.handle(url.path, parse_qs(url.query))
+				except Exception as e:
+					status, content_type, body = 500, 'text/plain', ('%s\n' %(e)).encode()
+				self.send_response(status)
+				self.send_header('Content-Type', content_type)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self, format, *args):
+				pass
+		# refresh timer
+		if not(self.interval is None):
+			threading.Thread(target=self.refresh_loop, daemon=True).start()
+		# serve
+		httpd = ThreadingHTTPServer((host, port), Handler)
+		print('serving %s on http://%s:%d/' %(', '.join(self.data_sets), host, httpd.server_address[1]))
+		try:
+			httpd.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.stopped.set()
+			httpd.server_close()
+	#___________________________________________________________________________
+	#
@@ -0,0 +1,262 @@
+##############################################################################80
+#                                                                              #
+#                              Synthetic Data-sets                             #
+#                                                                              #
+# (2020) Nicolo Fabbiane                                                       #
+#                                                                              #
+################################################################################
+
+# Writers of synthetic data-sets with the same layout as the upstream
+# repositories read by libpy.rawdata (for offline tests and benchmarks).
+
+
+################################################################################
+# Series
+#_______________________________________________________________________________
+#
+def logistic_series(nregions, ndays, seed=0):
+	"""
+	"""
+	# modules
+	import numpy as np
+	rng = np.random.default_rng(seed)
+	# random epidemic for each region (final size, width and center)
+	t = np.arange(ndays)
+	A = rng.lognormal(8., 1.5, nregions)[:, None]
+	a = rng.uniform(4., 15., nregions)[:, None]
+	b = rng.uniform(.2, .8, nregions)[:, None]*ndays
+	# cumulative confirmed, recovered and deaths (regions x days)
+	confirmed = np.round(A     /(1. + np.exp((b   -t)/a      ))).astype(np.int64)
+	recovered = np.round(A*.80 /(1. + np.exp((b+14-t)/(a+2.)))).astype(np.int64)
+	deaths    = np.round(A*.05 /(1. + np.exp((b+ 5-t)/a      ))).astype(np.int64)
+	recovered = np.minimum(recovered, confirmed - deaths)
+	return confirmed, recovered, deaths
+#_______________________________________________________________________________
+#
+def dates(ndays, start):
+	"""
+	"""
+	# modules
+	import datetime as dt
+	return [start + dt.timedelta(days=d) for d in range(ndays)]
+#_______________________________________________________________________________
+#
+
+
+
+
+################################################################################
+# Writers
+#_______________________________________________________________________________
+#
+def write_jhu(path, nregions=100, ndays=100, sparsity=0., provinces=1, seed=0):
+	"""
+	"""
+	# modules
+	import os
+	import datetime as dt
+	import numpy as np
+	rng = np.random.default_rng(seed+1)
+	# time-series files
+	timeseries_path = os.path.join(path, 'csse_covid_19_data', 'csse_covid_19_time_series')
+	if not(os.path.isdir(timeseries_path)): os.makedirs(timeseries_path)
+	# header (month/day/two-digit year)
+	time = dates(ndays, dt.date(2020, 1, 22))
+	header = 'Province/State,Country/Region,Lat,Long,'
+	header+= ','.join(['%d/%d/%02d' %(t.month, t.day, t.year % 100) for t in time])
+	# one row for each province, grouped by country
+	series = logistic_series(nregions, ndays, seed)
+	for name, data in zip(['Confirmed', 'Recovered', 'Deaths'], series):
+		blank = rng.random(data.shape) < sparsity
+		with open(os.path.join(timeseries_path, 'time_series_19-covid-%s.csv' %(name)), 'w') as f:
+			f.write(header + '\n')
+			for i in range(nregions):
+				cells = [str(v) for v in data[i]]
+				for j in np.flatnonzero(blank[i]): cells[j] = ''
+				province = 'Province %05d' %(i) if provinces > 1 else ''
+				f.write('%s,Country %05d,0.0,0.0,%s\n' %(province, i // provinces, ','.join(cells)))
+#_______________________________________________________________________________
+#
+def write_dpc(path, nregions=21, ndays=100, sparsity=0., seed=0):
+	"""
+	"""
+	# modules
+	import os
+	import datetime as dt
+	import numpy as np
+	rng = np.random.default_rng(seed+1)
+	# time-series file
+	timeseries_path = os.path.join(path, 'dati-regioni')
+	if not(os.path.isdir(timeseries_path)): os.makedirs(timeseries_path)
+	# data
+	time = dates(ndays, dt.datetime(2020, 2, 24, 18))
+	confirmed, recovered, deaths = logistic_series(nregions, ndays, seed)
+	active    = confirmed - recovered - deaths
+	intensive = active // 20
+	missing   = rng.random(confirmed.shape) < sparsity
+	# one row for each day and region (missing rows are skipped)
+	with open(os.path.join(timeseries_path, 'dpc-covid19-ita-regioni.csv'), 'w') as f:
+		f.write('data,stato,codice_regione,denominazione_regione,lat,long,'
+		        'ricoverati_con_sintomi,terapia_intensiva,totale_ospedalizzati,'
+		        'isolamento_domiciliare,totale_attualmente_positivi,'
+		        'nuovi_attualmente_positivi,dimessi_guariti,deceduti,totale_casi,'
+		        'tamponi\n')
+		for j, t in enumerate(time):
+			stamp = t.strftime('%Y-%m-%d %H:%M:%S')
+			for i in range(nregions):
+				if missing[i, j]: continue
+				f.write('%s,ITA,%d,Regione %05d,0.0,0.0,0,%d,0,0,%d,0,%d,%d,%d,0\n'
+				        %(stamp, i, i, intensive[i, j], active[i, j],
+				          recovered[i, j], deaths[i, j], confirmed[i, j]))
+#_______________________________________________________________________________
+#
+def write_ofr(path, nregions=13, ndays=100, sparsity=0., seed=0):
+	"""
+	"""
+	# modules
+	import os
+	import datetime as dt
+	import numpy as np
+	rng = np.random.default_rng(seed+1)
+	# time-series file
+	timeseries_path = os.path.join(path, 'dist')
+	if not(os.path.isdir(timeseries_path)): os.makedirs(timeseries_path)
+	# data (regions and country total)
+	time = dates(ndays, dt.date(2020, 3, 1))
+	confirmed, recovered, deaths = logistic_series(nregions, ndays, seed)
+	intensive = (confirmed - recovered - deaths) // 20
+	codes = ['REG-%02d' %(i) for i in range(nregions)] + ['FRA']
+	names = ['Region %05d' %(i) for i in range(nregions)] + ['France']
+	series = [np.vstack([data, data.sum(axis=0)]) for data in [confirmed, deaths, intensive, recovered]]
+	blank  = rng.random(series[2].shape) < sparsity
+	# one row for each day, region and source (only the official ones are read)
+	with open(os.path.join(timeseries_path, 'chiffres-cles.csv'), 'w') as f:
+		f.write('date,granularite,maille_code,maille_nom,cas_confirmes,deces,'
+		        'reanimation,hospitalises,gueris,source_nom,source_url,'
+		        'source_archive,source_type\n')
+		for j, t in enumerate(time):
+			stamp = t.strftime('%Y-%m-%d')
+			for i, (code, name) in enumerate(zip(codes, names)):
+				c, d, r, g = [data[i, j] for data in series]
+				r = '' if blank[i, j] else str(r)
+				f.write('%s,region,%s,%s,%d,%d,%s,0,%d,Ministère des Solidarités et de la Santé,,,\n'
+				        %(stamp, code, name, c, d, r, g))
+				f.write('%s,region,%s,%s,%d,%d,0,0,0,OpenCOVID19-fr,,,\n'
+				        %(stamp, code, name, 2*c, 2*d))
+#_______________________________________________________________________________
+#
+def write_jhu_us(path, nregions=100, ndays=100, sparsity=0., counties=10, seed=0):
+	"""
+	"""
+	# modules
+	import os
+	import datetime as dt
+	import numpy as np
+	rng = np.random.default_rng(seed+1)
+	# time-series files
+	timeseries_path = os.path.join(path, 'csse_covid_19_data', 'csse_covid_19_time_series')
+	if not(os.path.isdir(timeseries_path)): os.makedirs(timeseries_path)
+	# header (month/day/two-digit year, population only in the deaths file)
+	time = dates(ndays, dt.date(2020, 1, 22))
+	stamps = ','.join(['%d/%d/%02d' %(t.month, t.day, t.year % 100) for t in time])
+	header = 'UID,iso2,iso3,code3,FIPS,Admin2,Province_State,Country_Region,Lat,Long_,Combined_Key'
+	# one row for each county, the same county names in each state
+	confirmed, recovered, deaths = logistic_series(nregions, ndays, seed)
+	for name, data, population in [('confirmed', confirmed, False), ('deaths', deaths, True)]:
+		blank = rng.random(data.shape) < sparsity
+		with open(os.path.join(timeseries_path, 'time_series_covid19_%s_US.csv' %(name)), 'w') as f:
+			f.write(header + (',Population,' if population else ',') + stamps + '\n')
+			for i in range(nregions):
+				cells = [str(v) for v in data[i]]
+				for j in np.flatnonzero(blank[i]): cells[j] = ''
+				county, state = 'County %03d' %(i % counties), 'State %03d' %(i // counties)
+				f.write('%d,US,USA,840,%d.0,%s,%s,US,0.0,0.0,"%s, %s, US",%s%s\n'
+				        %(84000000+i, 1000+i, county, state, county, state,
+				          '%d,' %(100000+i) if population else '', ','.join(cells)))
+#_______________________________________________________________________________
+#
+def write_dpc_province(path, nregions=100, ndays=100, sparsity=0., provinces=10, seed=0):
+	"""
+	"""
+	# modules
+	import os
+	import datetime as dt
+	import numpy as np
+	rng = np.random.default_rng(seed+1)
+	# time-series file
+	timeseries_path = os.path.join(path, 'dati-province')
+	if not(os.path.isdir(timeseries_path)): os.makedirs(timeseries_path)
+	# data (the last province of each region with the upstream name of the
+	# cases not yet assigned)
+	time = dates(ndays, dt.datetime(2020, 2, 24, 18))
+	confirmed = logistic_series(nregions, ndays, seed)[0]
+	missing   = rng.random(confirmed.shape) < sparsity
+	names = ['Provincia %05d' %(i) if (i % provinces < provinces-1)
+	         else 'In fase di definizione/aggiornamento' for i in range(nregions)]
+	# one row for each day and province (missing rows are skipped)
+	with open(os.path.join(timeseries_path, 'dpc-covid19-ita-province.csv'), 'w') as f:
+		f.write('data,stato,codice_regione,denominazione_regione,codice_provincia,'
+		        'denominazione_provincia,sigla_provincia,lat,long,totale_casi\n')
+		for j, t in enumerate(time):
+			stamp = t.strftime('%Y-%m-%dT%H:%M:%S')
+			for i in range(nregions):
+				if missing[i, j]: continue
+				f.write('%s,ITA,%d,Regione %05d,%d,%s,XX,0.0,0.0,%d\n'
+				        %(stamp, i // provinces, i // provinces, i, names[i], confirmed[i, j]))
+#_______________________________________________________________________________
+#
+def write_ofr_departement(path, nregions=101, ndays=100, sparsity=0., seed=0):
+	"""
+	"""
+	# modules
+	import os
+	import datetime as dt
+	import numpy as np
+	rng = np.random.default_rng(seed+1)
+	# time-series file
+	timeseries_path = os.path.join(path, 'dist')
+	if not(os.path.isdir(timeseries_path)): os.makedirs(timeseries_path)
+	# data (departments and country total)
+	time = dates(ndays, dt.date(2020, 3, 1))
+	confirmed, recovered, deaths = logistic_series(nregions, ndays, seed)
+	intensive = (confirmed - recovered - deaths) // 20
+	series = [confirmed, deaths, intensive, recovered]
+	blank  = rng.random(confirmed.shape) < sparsity
+	# one row for each day, department and source (the country rows and the
+	# other sources are not read)
+	with open(os.path.join(timeseries_path, 'chiffres-cles.csv'), 'w') as f:
+		f.write('date,granularite,maille_code,maille_nom,cas_confirmes,deces,'
+		        'reanimation,hospitalises,gueris,source_nom,source_url,'
+		        'source_archive,source_type\n')
+		for j, t in enumerate(time):
+			stamp = t.strftime('%Y-%m-%d')
+			for i in range(nregions):
+				c, d, r, g = [data[i, j] for data in series]
+				r = '' if blank[i, j] else str(r)
+				f.write('%s,departement,DEP-%03d,Departement %05d,%d,%d,%s,0,%d,Santé publique France Data,,,\n'
+				        %(stamp, i, i, c, d, r, g))
+				f.write('%s,departement,DEP-%03d,Departement %05d,%d,%d,0,0,0,OpenCOVID19-fr,,,\n'
+				        %(stamp, i, i, 2*c, 2*d))
+			f.write('%s,pays,FRA,France,%d,%d,0,0,0,Ministère des Solidarités et de la Santé,,,\n'
+			        %(stamp, confirmed[:, j].sum(), deaths[:, j].sum()))
+#_______________________________________________________________________________
+#
+def write_data(path, data_fmt, nregions, ndays, sparsity=0., seed=0):
+	"""
+	"""
+	if data_fmt == 'jhu':
+		write_jhu(path, nregions, ndays, sparsity, seed=seed)
+	elif data_fmt == 'dpc':
+		write_dpc(path, nregions, ndays, sparsity, seed=seed)
+	elif data_fmt == 'ofr':
+		write_ofr(path, nregions, ndays, sparsity, seed=seed)
+	elif data_fmt == 'jhu-us':
+		write_jhu_us(path, nregions, ndays, sparsity, seed=seed)
+	elif data_fmt == 'dpc-province':
+		write_dpc_province(path, nregions, ndays, sparsity, seed=seed)
+	elif data_fmt == 'ofr-departement':
+		write_ofr_departement(path, nregions, ndays, sparsity, seed=seed)
+	else:
+		raise ValueError('unknown data format %s' %(data_fmt))
+#_______________________________________________________________________________
+#
@@ -7,20 +7,29 @@
 ################################################################################
 
 # system
-import os, sys
+import os, sys, io
+import json, hashlib
+import argparse
+import multiprocessing as mp
 
 # math 
 import numpy as np
-from scipy import optimize as spo
 import datetime as dt
 
 # visualization
 from matplotlib import rc
 from matplotlib import pyplot as plt
 from matplotlib import patches as ptc
+from matplotlib import ticker as mtk
+from matplotlib import dates as mdt
+from matplotlib.collections import PolyCollection
 
 # local libraries
 import libpy.rawdata as rd
+import libpy.profiling as pf
+from libpy.fitting import sigmoid, dsigmoiddx, fit_logistic, fit_logistic_sequence, bootstrap_logistic, backtest_logistic, FitCache
+from libpy.server import FigureServer
+from libpy.animation import FrameWriter
 
 
 
@@ -28,13 +37,74 @@ import libpy.rawdata as rd
 ################################################################################
 # Parameters
 #
-# data_set file_________________________________________________________________
-
-if len(sys.argv) > 1: data_set = os.path.basename(sys.argv[1]).split('.')[0]
-else: data_set = 'jhu'
+# command line__________________________________________________________________
+
+parser = argparse.ArgumentParser(description='COVID-19 statistics')
+parser.add_argument('data_sets', nargs='*', default=['jhu'], metavar='data_set',
+                    help='data-set file(s) (default: jhu)')
+parser.add_argument('--jobs', '-j', type=int, default=1,
+                    help='number of figures processed in parallel (default: 1)')
+parser.add_argument('--refit', action='store_true',
+                    help='ignore the fits stored by the previous runs')
+parser.add_argument('--formats', default='pdf,png',
+                    help='comma-separated output formats (default: pdf,png)')
+parser.add_argument('--usetex', action='store_true',
+                    help='render the text with LaTeX (slower, needs a TeX installation)')
+parser.add_argument('--force', action='store_true',
+                    help='render all figures, even if their data did not change')
+parser.add_argument('--offline', action='store_true',
+                    help='use the local data, without pulling the data repository')
+parser.add_argument('--max-age', type=float, default=None,
+                    help='do not pull if the data were fetched less than MAX_AGE minutes ago')
+parser.add_argument('--bands', type=int, default=0, metavar='N',
+                    help='shade confidence bands of the logistic fit from N bootstrap '
+                         'replicates (default: 0, no bands)')
+parser.add_argument('--band-level', type=float, default=.9,
+                    help='probability covered by the confidence bands (default: 0.9)')
+parser.add_argument('--backtest', action='store_true',
+                    help='refit the figures at every past cut-off and report the forecast '
+                         'errors instead of drawing them')
+parser.add_argument('--backtest-start', type=int, default=14, metavar='DAYS',
+                    help='days of data before the first cut-off of the backtest (default: 14)')
+parser.add_argument('--backtest-step', type=int, default=1, metavar='DAYS',
+                    help='days between the cut-offs of the backtest (default: 1)')
+parser.add_argument('--animate', default=None, metavar='FORMAT',
+                    help='write a day-by-day animation of each figure (e.g. mp4 or gif, '
+                         'PNG frames without ffmpeg) instead of drawing it')
+parser.add_argument('--fps', type=float, default=4.,
+                    help='frames (days) per second of the animations (default: 4)')
+parser.add_argument('--export', action='store_true',
+                    help='export the processed data for other processes (see RawData.open_processed)')
+parser.add_argument('--profile', default=None, metavar='FILE',
+                    help='write wall/CPU time, calls and peak memory of each stage and figure '
+                         'to FILE (JSON, or CSV if FILE ends with .csv)')
+parser.add_argument('--profile-stage', default=None, metavar='STAGE',
+                    help='also write the cProfile statistics of STAGE (git, cache, read, '
+                         'clean, aggregate, derive, fit, render or figure) to FILE_STAGE.prof')
+parser.add_argument('--serve', default=None, metavar='[HOST:]PORT',
+                    help='serve the figures over HTTP instead of writing them to figs/')
+parser.add_argument('--refresh', type=float, default=10.,
+                    help='minutes between data refreshes when serving (default: 10)')
+parser.add_argument('--cache-size', type=int, default=256,
+                    help='number of responses kept in memory when serving (default: 256)')
+args = parser.parse_args()
+
+# instrumentation (also enabled by COVID19_PROFILE and COVID19_PROFILE_STAGE)
+if not(args.profile is None):
+	pf.enable(args.profile, args.profile_stage)
+
+
+# data_set files________________________________________________________________
+
+data_sets = [os.path.basename(data_set).split('.')[0] for data_set in args.data_sets]
 
 # load data_set data
-ds = __import__(data_set)
+ds = dict((data_set, __import__(data_set)) for data_set in data_sets)
+
+# data formats declared by the data-sets (see rd.formats)
+for data_set in data_sets:
+	for name, schema in getattr(ds[data_set], 'formats', {}).items():
+		rd.register_format(name, schema)
 
 
 # common________________________________________________________________________
@@ -42,6 +112,12 @@ ds = __import__(data_set)
 # number of days in the future
 future = 7
 
+# days of data (from the first case) in the first frame of the animations
+animation_days = 14
+
+# version of the figure layout (bump it to render again all figures)
+renderer_version = 1
+
 
 
 
@@ -50,50 +126,277 @@ future = 7
 #
 # raw data______________________________________________________________________
 
-rawdata = rd.RawData(**ds.raw_data)
+rawdata = dict((data_set, rd.RawData(offline=args.offline, max_age=args.max_age,
+                                      **ds[data_set].raw_data)) for data_set in data_sets)
+
+# groups of regions declared by the data-sets (also used by `select`)
+for data_set in data_sets:
+	rawdata[data_set].set_groups(getattr(ds[data_set], 'groups', {}))
+
+# pull and read all data-sets concurrently (shared by the parallel workers)
+rd.load_all(list(rawdata.values()))
+
+# aggregate the groups once
+for data_set in data_sets:
+	rawdata[data_set].precompute_groups()
+
+# memory-mapped copy of the processed data, shared by other consumers
+if args.export:
+	for data_set in data_sets:
+		print('exported %s' %(rawdata[data_set].export_processed()))
+
+
+# previous fits_________________________________________________________________
+
+if not(os.path.isdir('figs')): os.mkdir('figs')
+fits = dict((data_set, FitCache(os.path.join('figs', 'fits_%s.json' %(data_set))))
+            for data_set in data_sets)
+if args.refit:
+	for data_set in data_sets: fits[data_set].entries = {}
+
+
+# rendered figures______________________________________________________________
+
+# hash of the inputs of the figures in figs/
+manifest_file = os.path.join('figs', 'manifest.json')
+manifest = {}
+if os.path.isfile(manifest_file) and not(args.force):
+	try:
+		with open(manifest_file, 'r') as f: manifest = json.load(f)
+	except ValueError:
+		manifest = {}
 
 
 
 
 ################################################################################
-# Loop on figures
+# Figures
 #
 # initialize figure_____________________________________________________________
 
 # force text to sans-serif
 rc('font', family='sans-serif')
-rc('text.latex', preamble=[r'\usepackage{cmbright}', r'\usepackage{amsmath}'])
-rc('text', usetex=True)
+if args.usetex:
+	rc('text.latex', preamble=r'\usepackage{cmbright}\usepackage{amsmath}')
+	rc('text', usetex=True)
+
+# text labels (LaTeX or matplotlib mathtext)
+if args.usetex:
+	labels = {'peak'  : r'$~%d~$',
+	          'final' : r'$%d~(%.1f\%%)$',
+	          'ylabel': r'inactive~$\quad|\quad$~~active~\mbox{}',
+	          'title' : r'%s -- $%d$ confirmed cases'}
+else:
+	labels = {'peak'  : r'$\ %d\ $',
+	          'final' : r'$%d\ (%.1f\%%)$',
+	          'ylabel': r'inactive $\quad|\quad$ active',
+	          'title' : u'%s – $%d$ confirmed cases'}
+
+# figure, axes and artists of the current process for each data-set (created
+# on first use)
+artists = {}
+
+def init_figure(time):
+	"""
+	"""
+	# time (the same for all figures of a data-set)
+	time = np.array(time)
+	zero = np.zeros(len(time))
+
+	# create figure and axes
+	fig = plt.figure()
+	ax  = plt.subplot(111)
+
+	# axes position (to fit the date)
+	bb = ax.get_position()
+	bb.y0+= (1-bb.y1)/3.; bb.y1+= (1-bb.y1)/3.;
+	bb.x1-=    bb.x0 /1.5;bb.x0-=    bb.x0 /4.;
+	ax.set_position(bb)
+
+	# create twin ax for final values as ticks
+	axt = ax.twinx()
+	axt.set_position(ax.get_position())
+
+	# histograms
+	hh = [] # collect handles for legend
+	hh.append(ax.bar(time, zero, color=[1., .8, 0.], label=r'total active cases'))
+	hh.append(ax.bar(time, zero, color=[1., .5, 0.], label=r'intensive-care'))
+	hh.append(ax.bar(time, zero, color=[1., 0., 0.], label=r'deaths'))
+	hh.append(ax.bar(time, zero, color=[0., 0., 1.], label=r'recovered'))
 
-# create figure and axes
-fig = plt.figure()
-ax  = plt.subplot(111)
+	# daily variations in legend (labels updated for each figure)
+	hh+= [ptc.Patch(color='none', label=' ') for _ in range(4)]
 
-# axes position (to fit the date)
-bb = ax.get_position()
-bb.y0+= (1-bb.y1)/3.; bb.y1+= (1-bb.y1)/3.;
-bb.x1-=    bb.x0 /1.5;bb.x0-=    bb.x0 /4.;
-ax.set_position(bb)
+	# new cases
+	hl = [] # collect handles for legend
+	hl+= ax.plot(time, zero, '-k', label=r'new cases')
+
+	# projections
+	hp = []
+	hp+= ax.plot([], [], '--', color=[0., 0., 1.], lw=.8)
+	hp+= ax.plot([], [], '--', color=[1., 0., 0.], lw=.8)
+	hp+= ax.plot([], [], '--', color=[1., .8, 0.], lw=.8)
+	hp+= ax.plot([], [], '--', color=[0., 0., 0.], lw=.8, label=r'logistic fit')
+	hl.append(hp[-1])
+
+	# confidence bands of the projections (empty without --bands)
+	hc = []
+	for h in hp:
+		hc.append(PolyCollection([], facecolor=h.get_color(), edgecolor='none', alpha=.2))
+		ax.add_collection(hc[-1], autolim=False)
+
+	# peaks (active, intensive-care and new cases)
+	hm = []; tm = []
+	for va in ['bottom', 'top', 'bottom']:
+		hm+= ax.plot([time[-1]], [0.], '.k', label='maxima')
+		tm.append(ax.text(time[-1], 0., '', va=va, ha='left'))
+	hl.append(hm[0])
 
-# create twin ax for final values as ticks
-axt = ax.twinx()
-axt.set_position(ax.get_position())
+	# grid
+	hz = ax.axhline(0., color='k', lw=.8)
+	ax.grid()
 
+	# scale of the y ticks
+	ts = ax.text(0., 1.01, '', transform=ax.transAxes)
+
+	# label
+	ax.set_ylabel(labels['ylabel'])
+
+	# legend(s)
+	l1 = ax.legend(hh, [h.get_label() for h in hh], framealpha=1., loc='lower left', ncol=2)
+	l2 = ax.legend(hl, [h.get_label() for h in hl], framealpha=1., loc='upper left', ncol=1)
+	ax.add_artist(l1)
+
+	return {'fig': fig, 'ax': ax, 'axt': axt, 'bars': hh[:4], 'days': l1.get_texts()[4:],
+	        'new': hl[0], 'proj': hp, 'bands': hc, 'peaks': hm, 'peak_texts': tm, 'scale': ts,
+	        'zero': hz, 'legends': [l1, l2]}
+
+def update_bars(bars, heights, bottoms=0.):
+	"""
+	"""
+	bottoms = np.broadcast_to(bottoms, np.shape(heights))
+	for rect, height, bottom in zip(bars, heights, bottoms):
+		rect.set_y(bottom)
+		rect.set_height(height)
+
+def save_figure(fig, name):
+	"""
+	"""
+	for fmt in args.formats.split(','):
+		filename = os.path.join('figs', '%s.%s' %(name, fmt))
+		with pf.stage('render'):
+			if (fmt == 'png') and hasattr(fig.canvas, 'buffer_rgba'):
+				# rasterize once and write the canvas buffer
+				fig.canvas.draw()
+				plt.imsave(filename, np.asarray(fig.canvas.buffer_rgba()))
+			else:
+				fig.savefig(filename)
+
+
+def set_axes(art, time, past, ymax):
+	"""
+	"""
+	ax, axt = art['ax'], art['axt']
+
+	# axis limits
+	ax.set_xlim([np.max(time)+dt.timedelta(days=past), np.max(time)+dt.timedelta(days=future)])
+	ax.set_ylim(np.array([-1, 1])*ymax)
+
+	# x ticks
+	tks = [np.max(time)+dt.timedelta(days=future)]
+	while tks[-1] >= np.max(time)+dt.timedelta(days=past):
+		tks+= [tks[-1]-dt.timedelta(days=7)]
+	tks.pop(-1)
+	# - fix ticks and compute labels
+	ax.set_xticks(tks)
+	ax.set_xticklabels([tk.date() for tk in tks], rotation=30, ha='right')
+
+	# y ticks (automatic for the current limits)
+	ax.yaxis.set_major_locator(mtk.AutoLocator())
+	tks = ax.get_yticks()
+	# - compute scale (avoid thousands)
+	scale =  int(np.floor(np.log10(np.max(tks))/3))*3
+	art['scale'].set_text(r'$\times 10^{%d}$' %(scale) if scale != 0 else '')
+	# - fix ticks and compute labels
+	tks = [np.round(tk/(10**scale))*(10**scale) for tk in tks]
+	ax.set_yticks(tks)
+	ax.set_yticklabels(['%d' %(np.abs(tk)/(10**scale)) for tk in tks])
+
+	# axis limits (secondary axis)
+	ax.set_ylim(np.array([-1, 1])*ymax)
+	axt.set_ylim(ax.get_ylim())
+
+
+def figure_name(kind, data_set, title):
+	"""
+	"""
+	# output name (and manifest key) of a figure, with the data-set when several
+	# of them are rendered together (their figures may share the same titles)
+	if len(data_sets) == 1: return '%s_%s' %(kind, title)
+	return '%s_%s_%s' %(kind, data_set, title)
 
-# loop__________________________________________________________________________
 
-for title, regions in ds.figures.items():
+def figure_hash(title, time, series, psig):
+	"""
+	"""
+	h = hashlib.sha1()
+	h.update(json.dumps([renderer_version, future, args.usetex, args.bands, args.band_level,
+	                     title, str(time[0]), str(time[-1])]).encode())
+	for data in series:
+		h.update(np.ascontiguousarray(data, dtype=np.int64).tobytes())
+	h.update(np.ascontiguousarray(psig, dtype=float).tobytes())
+	return h.hexdigest()
+
+
+# logistic fit__________________________________________________________________
+
+def get_fit(data_set, regions, time, confirmed, deaths, recovered):
+	"""
+	"""
+	days = np.array([(t-time[-1]).days for t in time])
+
+	# comupte coefficients (reuse or start from the previous fit if available)
+	fit_key = '%s:%s' %(data_set, '*' if regions is None else ','.join(sorted(regions)))
+	psig, p0 = fits[data_set].lookup(fit_key, time, confirmed, deaths, recovered)
+	if psig is None:
+		psig = fit_logistic(days, confirmed, deaths, recovered, future=future, p0=p0)
+	fit_entry = fits[data_set].store(fit_key, time, confirmed, deaths, recovered, psig)
+	return psig, fit_key, fit_entry
+
+
+def projections(dayse, psig):
+	"""
+	"""
+	# stacked deaths and recovered, active on top of them and new cases (the
+	# parameters may hold several fits along a second axis)
+	confirmed_psig= psig[0:3]
+	deaths_psig   = psig[3:6]
+	recovered_psig= psig[6:9]
+	return [-sigmoid(dayse, *deaths_psig)-sigmoid(dayse, *recovered_psig),
+	        -sigmoid(dayse, *deaths_psig)                                ,
+	        -sigmoid(dayse, *deaths_psig)-sigmoid(dayse, *recovered_psig)
+	        +sigmoid(dayse, *confirmed_psig)                             ,
+	         dsigmoiddx(dayse, *confirmed_psig)]
+
+
+# figure________________________________________________________________________
+
+def plot_figure(data_set, title, regions, output=None):
+	"""
+	"""
+	# text output (printed by the main process)
+	log = []
 
 	# get time-series___________________________________________________________
 
 	# time
-	time = np.array(rawdata.get_time())
+	time = np.array(rawdata[data_set].get_time())
 	
-	print('')
-	print('%s: %s' %(title, time[-1]))
+	log.append('')
+	log.append('%s: %s' %(title if len(data_sets) == 1 else '%s:%s' %(data_set, title), time[-1]))
 
 	# cumulative data for the requested regions
-	confirmed, recovered, deaths, active, intensive = rawdata.get_data_for_regions(regions)
+	confirmed, recovered, deaths, active, intensive = rawdata[data_set].get_data_for_regions(regions)
 
 	# transform in numpy arrays
 	confirmed = np.array(confirmed)
@@ -102,94 +405,69 @@ for title, regions in ds.figures.items():
 	active    = np.array(active)
 	intensive = np.array(intensive)
 
-	# compute new daily cases
-	new   = np.append([0], confirmed[1:]-confirmed[:-1])
-
-	# compute  daily delta
-	Dday_confirmed = (confirmed[-1]-confirmed[-2])/float(confirmed[-2])
-	Dday_active    = (active[-1]   -active[-2]   )/float(active[-2])
-	Dday_deaths    = (deaths[-1]   -deaths[-2]   )/float(deaths[-2])
-	Dday_recovered = (recovered[-1]-recovered[-2])/float(recovered[-2])
-	Dday_intensive = (intensive[-1]-intensive[-2])/float(intensive[-2])
+	# new daily cases, daily delta and peaks (cached with the aggregate)
+	new   = rawdata[data_set].get_derived_for_regions('increments', regions)[:, rd.metrics.index('confirmed')]
+	Dday  = dict(zip(rd.metrics, rawdata[data_set].get_derived_for_regions('growth', regions)[-1]))
+	peaks = dict(zip(rd.metrics, rawdata[data_set].get_derived_for_regions('peaks', regions)))
+	peaks['new'] = rawdata[data_set].get_derived_for_regions('increment_peaks', regions)[rd.metrics.index('confirmed')]
 
 
 	# compute logistic fit______________________________________________________
 
 	days = np.array([(t-time[-1]).days for t in time])
 
-	# define sigmoid function
-	def sigmoid(x, A, a, b):
-		return A/(1. + np.exp((b-x)/a))
-
-	# define sigmoid function
-	def dsigmoiddx(x, A, a, b):
-		return A/(1. + np.exp((b-x)/a))**2 * np.exp((b-x)/a) / a
-
-	# define sigmoid function
-	def fitfun(x, C, ac, bc, D, ad, bd, R, ar, br):
-		R = C-D
-		return [[sigmoid(xi, C, ac, bc),
-		         sigmoid(xi, D, ad, bd),
-		         sigmoid(xi, R, ar, br)] for xi in x]
-
-	# define error function
-	def fiterr(ps, Xs, Ys):
-		ys = fitfun(Xs, *ps)
-		error = np.sum((np.array(Ys) - np.array(ys))**2)
-		return error
-
-	# comupte coefficients
-	Ys = [[c, d, r] for c, d, r in zip(confirmed, deaths, recovered)]
-	p0 =  (2*confirmed[-1], 1., future,
-	       2*   deaths[-1], 1., future,
-	       2*recovered[-1], 1., future)
-	bd = ((confirmed[-1], np.inf), ( 1., np.inf), (-np.inf, np.inf),
-	      (   deaths[-1], np.inf), ( 1., np.inf), (-np.inf, np.inf),
-	      (recovered[-1], np.inf), ( 1., np.inf), (-np.inf, np.inf))
-	sol = spo.minimize(fiterr, args=(days, Ys), x0=p0, bounds=bd)
-	confirmed_psig= sol.x[0:3]
-	deaths_psig   = sol.x[3:6]
-	recovered_psig= sol.x[6:9]; recovered_psig[0]=confirmed_psig[0]-deaths_psig[0]
-	print('           |      today      |    tomorrow     | final  ')
-	print('-----------+-----------------+-----------------+--------')
-	print(' confirmed | %6d (%+6d) | %6d (%+6d) | %6d'
+	psig, fit_key, fit_entry = get_fit(data_set, regions, time, confirmed, deaths, recovered)
+	confirmed_psig= psig[0:3]
+	deaths_psig   = psig[3:6]
+	recovered_psig= psig[6:9]
+	log.append('           |      today      |    tomorrow     | final  ')
+	log.append('-----------+-----------------+-----------------+--------')
+	log.append(' confirmed | %6d (%+6d) | %6d (%+6d) | %6d'
 	      %(confirmed[-1], confirmed[-1]-confirmed[-2],
 	        int(sigmoid(1, *confirmed_psig)), int(dsigmoiddx(1, *confirmed_psig)),
 	        int(confirmed_psig[0])))
-	print(' deaths    | %6d (%+6d) | %6d (%+6d) | %6d'
+	log.append(' deaths    | %6d (%+6d) | %6d (%+6d) | %6d'
 	      %(deaths[-1], deaths[-1]-deaths[-2],
 	        int(sigmoid(1, *deaths_psig)), int(dsigmoiddx(1, *deaths_psig)),
 	        int(deaths_psig[0])))
-	print(' recovered | %6d (%+6d) | %6d (%+6d) | %6d'
+	log.append(' recovered | %6d (%+6d) | %6d (%+6d) | %6d'
 	      %(recovered[-1], recovered[-1]-recovered[-2],
 	        int(sigmoid(1, *recovered_psig)), int(dsigmoiddx(1, *recovered_psig)),
 	        int(recovered_psig[0])))
 
 
-	# re-initialize figure______________________________________________________
+	# skip unchanged figures____________________________________________________
 
-	ax.cla()
+	name = figure_name('histogram', data_set, title)
+	fig_hash = figure_hash(title, time, [confirmed, recovered, deaths, active, intensive], psig)
+	outputs = [os.path.join('figs', '%s.%s' %(name, fmt)) for fmt in args.formats.split(',')]
+	if (output is None) and (manifest.get(name) == fig_hash) and all([os.path.isfile(f) for f in outputs]):
+		log.append('(unchanged)')
+		return '\n'.join(log), (data_set, fit_key, fit_entry), (name, fig_hash)
+
+	# figure, axes and artists
+	if not(data_set in artists): artists[data_set] = init_figure(time)
+	art = artists[data_set]
+	fig, ax, axt = art['fig'], art['ax'], art['axt']
 
 
 	# plot histograms___________________________________________________________
 
-	hh = [] # collect handles for legend
-	hh.append(ax.bar(time,  active   , color=[1., .8, 0.], label=r'total active cases'))
-	hh.append(ax.bar(time,  intensive, color=[1., .5, 0.], label=r'intensive-care'))
-	hh.append(ax.bar(time, -deaths   , color=[1., 0., 0.], label=r'deaths'))
-	hh.append(ax.bar(time, -recovered, color=[0., 0., 1.], bottom=-deaths, label=r'recovered'))
+	update_bars(art['bars'][0],  active)
+	update_bars(art['bars'][1],  intensive)
+	update_bars(art['bars'][2], -deaths)
+	update_bars(art['bars'][3], -recovered, bottoms=-deaths)
 	
 	# add projection to legend
-	hh.append(ptc.Patch(color='none', label=r'$%+.1f\%%$/day' %(Dday_active*100)))
-	hh.append(ptc.Patch(color='none', label=r'$%+.1f\%%$/day' %(Dday_intensive*100)))
-	hh.append(ptc.Patch(color='none', label=r'$%+.1f\%%$/day' %(Dday_deaths*100)))
-	hh.append(ptc.Patch(color='none', label=r'$%+.1f\%%$/day' %(Dday_recovered*100)))
+	art['days'][0].set_text(r'$%+.1f\%%$/day' %(Dday['active']*100))
+	art['days'][1].set_text(r'$%+.1f\%%$/day' %(Dday['intensive']*100))
+	art['days'][2].set_text(r'$%+.1f\%%$/day' %(Dday['deaths']*100))
+	art['days'][3].set_text(r'$%+.1f\%%$/day' %(Dday['recovered']*100))
 
 
 	# plot new cases____________________________________________________________
 
-	hl = [] # collect handles for legend
-	hl+= ax.plot(time, new, '-k', label=r'new cases')
+	art['new'].set_ydata(new)
 
 
 	# exponential fits__________________________________________________________
@@ -200,32 +478,30 @@ for title, regions in ds.figures.items():
 
 	# extend time
 	dayse = np.array(range(past, int(future)+1))
-	timee = np.array([time[-1] + dt.timedelta(days=d) for d in dayse])
+	timee = np.array([time[-1] + dt.timedelta(days=int(d)) for d in dayse])
 
 	# plot projections - sigmoid
-	ax.plot(timee, -sigmoid(dayse, *deaths_psig)-sigmoid(dayse, *recovered_psig), '--', color=[0., 0., 1.], lw=.8)
-	ax.plot(timee, -sigmoid(dayse, *deaths_psig)                                , '--', color=[1., 0., 0.], lw=.8)
-	ax.plot(timee, -sigmoid(dayse, *deaths_psig)-sigmoid(dayse, *recovered_psig)
-	               +sigmoid(dayse, *confirmed_psig)                             , '--', color=[1., .8, 0.], lw=.8)
-	hl+= ax.plot(timee,  dsigmoiddx(dayse, *confirmed_psig), '--', color=[0., 0., 0.], lw=.8, label=r'logistic fit')
+	for h, curve in zip(art['proj'], projections(dayse, psig)):
+		h.set_data(timee, curve)
 
+	# confidence bands - quantiles of the bootstrap replicates
+	for h in art['bands']: h.set_verts([])
+	if args.bands > 0:
+		pboot = bootstrap_logistic(days, confirmed, deaths, recovered, psig, nboot=args.bands)
+		x = mdt.date2num(timee)
+		for h, curves in zip(art['bands'], projections(dayse, pboot.T[:, :, None])):
+			lower, upper = np.quantile(curves, [(1.-args.band_level)/2., (1.+args.band_level)/2.], axis=0)
+			h.set_verts([np.column_stack([np.append(x, x[::-1]), np.append(lower, upper[::-1])])])
 
-	# plot peak_________________________________________________________________
-
-	# active cases
-	iM = np.argmax(active)
-	hl+= ax.plot(time[iM], active[iM], '.k', label='maxima')
-	ax.text(time[iM], active[iM], r'$~%d~$' %(active[iM]), va='bottom', ha='left')
 
-	# intensive-care cases
-	iM = np.argmax(intensive)
-	ax.plot(time[iM], intensive[iM], '.k')
-	ax.text(time[iM], intensive[iM], r'$~%d~$' %(intensive[iM]), va='top', ha='left')
+	# plot peak_________________________________________________________________
 
-	# new cases
-	iM = np.argmax(new)
-	ax.plot(time[iM], new[iM], '.k')
-	ax.text(time[iM], new[iM], r'$~%d~$' %(new[iM]), va='bottom', ha='left')
+	# active, intensive-care and new cases
+	for hm, tm, data, iM in zip(art['peaks'], art['peak_texts'], [active, intensive, new],
+	                            [peaks['active'], peaks['intensive'], peaks['new']]):
+		hm.set_data([time[iM]], [data[iM]])
+		tm.set_position((time[iM], data[iM]))
+		tm.set_text(labels['peak'] %(data[iM]))
 
 
 	# plot last data-point______________________________________________________
@@ -235,11 +511,11 @@ for title, regions in ds.figures.items():
 
 	# active cases
 	tks.append(active[-1])
-	lbl.append(r'$%d~(%.1f\%%)$' %(active[-1], active[-1]/float(confirmed[-1])*100))
+	lbl.append(labels['final'] %(active[-1], active[-1]/float(confirmed[-1])*100))
 
 	# new cases
 	tks.append(new[-1])
-	lbl.append(r'$%d~(%.1f\%%)$' %(new[-1], new[-1]/float(confirmed[-1])*100))
+	lbl.append(labels['final'] %(new[-1], new[-1]/float(confirmed[-1])*100))
 
 	# intensive-care cases
 	#tks.append(intensive[-1])
@@ -247,11 +523,11 @@ for title, regions in ds.figures.items():
 
 	# deaths
 	tks.append(-deaths[-1])
-	lbl.append(r'$%d~(%.1f\%%)$' %(deaths[-1], deaths[-1]/float(confirmed[-1])*100))
+	lbl.append(labels['final'] %(deaths[-1], deaths[-1]/float(confirmed[-1])*100))
 
 	# recovered
 	tks.append(-recovered[-1]-deaths[-1])
-	lbl.append(r'$%d~(%.1f\%%)$' %(recovered[-1], recovered[-1]/float(confirmed[-1])*100))
+	lbl.append(labels['final'] %(recovered[-1], recovered[-1]/float(confirmed[-1])*100))
 
 	# add values and labels as tick of secondary axis
 	axt.set_yticks(tks)
@@ -260,52 +536,343 @@ for title, regions in ds.figures.items():
 
 	# axes______________________________________________________________________
 
-	# axis limits
-	ax.set_xlim([np.max(time)+dt.timedelta(days=past), np.max(time)+dt.timedelta(days=future)])
-	ax.set_ylim(np.array([-1, 1])*confirmed_psig[0])
-	
-	# grid
-	ax.plot(ax.get_xlim(), [0., 0.], '-k', lw=.8)
-	ax.grid()
-
-	# x ticks
-	tks = [np.max(time)+dt.timedelta(days=future)]
-	while tks[-1] >= np.max(time)+dt.timedelta(days=past):
-		tks+= [tks[-1]-dt.timedelta(days=7)]
-	tks.pop(-1)
-	# - fix ticks and compute labels
-	ax.set_xticks(tks)
-	ax.set_xticklabels([tk.date() for tk in tks], rotation=30, ha='right')
-
-	# y ticks
-	tks = ax.get_yticks()
-	# - compute scale (avoid thousands)
-	scale =  int(np.floor(np.log10(np.max(tks))/3))*3
-	if scale != 0:
-		ax.text(0., 1.01, r'$\times 10^{%d}$' %(scale), transform=ax.transAxes)
-	# - fix ticks and compute labels
-	tks = [np.round(tk/(10**scale))*(10**scale) for tk in tks]
-	ax.set_yticks(tks)
-	ax.set_yticklabels(['%d' %(np.abs(tk)/(10**scale)) for tk in tks])
-
-	# labels and title
-	ax.set_ylabel('inactive~$\quad|\quad$~~active~\mbox{}')
-
 	# title
-	ax.set_title('%s -- $%d$ confirmed cases' %(title, confirmed[-1]))
-
-	# legend(s)
-	l1 = ax.legend(hh, [h.get_label() for h in hh], framealpha=1., loc='lower left', ncol=2)
-	l2 = ax.legend(hl, [h.get_label() for h in hl], framealpha=1., loc='upper left', ncol=1)
-	ax.add_artist(l1)
-
-	# axis limits (secondary axis)
-	ax.set_ylim(np.array([-1, 1])*confirmed_psig[0])
-	axt.set_ylim(ax.get_ylim())
+	ax.set_title(labels['title'] %(title, confirmed[-1]))
+
+	# limits and ticks
+	set_axes(art, time, past, confirmed_psig[0])
+
+
+	# save figure (or pass it to the caller)____________________________________
+
+	if output is None:
+		save_figure(fig, name)
+	else:
+		output(fig)
+
+	return '\n'.join(log), (data_set, fit_key, fit_entry), (name, fig_hash)
+
+def plot_figure_item(item):
+	"""
+	"""
+	data_set, title, regions = item
+	with pf.figure('%s:%s' %(data_set, title)):
+		result = plot_figure(*item)
+	# stage timings of this process (merged by the main process)
+	return result, pf.take()
+
+
+# serve_________________________________________________________________________
+
+def render_png(data_set, title, regions):
+	"""
+	"""
+	# rasterize in memory
+	buf = io.BytesIO()
+	def output(fig):
+		fig.canvas.draw()
+		plt.imsave(buf, np.asarray(fig.canvas.buffer_rgba()), format='png')
+	plot_figure(data_set, title, regions, output=output)
+	return buf.getvalue()
+
+def series_json(data_set, regions):
+	"""
+	"""
+	time = np.array(rawdata[data_set].get_time())
+	confirmed, recovered, deaths, active, intensive = rawdata[data_set].get_data_for_regions(regions)
+	psig, _, _ = get_fit(data_set, regions, time, confirmed, deaths, recovered)
+	return {'time'     : [t.strftime('%Y-%m-%d') for t in time],
+	        'confirmed': confirmed.tolist(),
+	        'recovered': recovered.tolist(),
+	        'deaths'   : deaths.tolist(),
+	        'active'   : active.tolist(),
+	        'intensive': intensive.tolist(),
+	        'fit'      : dict(zip(['C', 'ac', 'bc', 'D', 'ad', 'bd', 'R', 'ar', 'br'],
+	                              [float(p) for p in psig]))}
+
+def describe(data_set):
+	"""
+	"""
+	time = rawdata[data_set].get_time()
+	return {'regions': rawdata[data_set].regions,
+	        'groups' : rawdata[data_set].groups,
+	        'figures': ds[data_set].figures,
+	        'time'   : [time[0].strftime('%Y-%m-%d'), time[-1].strftime('%Y-%m-%d')]}
+
+def resolve(data_set, regions):
+	"""
+	"""
+	# regions not found in the data, and number of rows selected
+	if regions is None: return [], len(rawdata[data_set].regions)
+	unknown = [region for region in sorted(rawdata[data_set].expand_groups(regions))
+	           if not(region in rawdata[data_set].index)]
+	return unknown, len(rawdata[data_set].get_rows(regions))
+
+def data_version(rawdata):
+	"""
+	"""
+	h = hashlib.sha1()
+	h.update(json.dumps([rawdata.regions, [str(t) for t in rawdata.time]]).encode())
+	h.update(np.ascontiguousarray(rawdata.data).tobytes())
+	return h.hexdigest()
+
+def reload():
+	"""
+	"""
+	# pull (as set by --offline and --max-age) and read into new objects: the
+	# served ones are not touched, so the requests go on meanwhile
+	new = dict((data_set, rd.RawData(offline=args.offline, max_age=args.max_age,
+	                                 **ds[data_set].raw_data)) for data_set in data_sets)
+	for data_set in data_sets:
+		new[data_set].set_groups(rawdata[data_set].groups)
+	rd.load_all(list(new.values()))
+	for data_set in data_sets:
+		new[data_set].precompute_groups()
+	# only the data-sets whose data changed
+	return dict((data_set, new[data_set]) for data_set in data_sets
+	            if data_version(new[data_set]) != data_version(rawdata[data_set]))
+
+def refresh(new):
+	"""
+	"""
+	# swap in the new data
+	changed = sorted(new.keys())
+	for data_set in changed: rawdata[data_set] = new[data_set]
+	# artists built for the previous days (one bar for each day)
+	for data_set in changed:
+		if data_set in artists: plt.close(artists.pop(data_set)['fig'])
+	for data_set in data_sets: fits[data_set].save()
+	return changed
+
+# resident data and figures served on demand (instead of writing them)
+if not(args.serve is None):
+	host, _, port = args.serve.rpartition(':')
+	server = FigureServer(data_sets, render_png, series_json, describe, resolve, reload, refresh,
+	                      interval=args.refresh if args.refresh > 0 else None,
+	                      maxsize=args.cache_size)
+	server.serve_forever(host or '127.0.0.1', int(port))
+	for data_set in data_sets: fits[data_set].save()
+	sys.exit()
+
+
+# backtest______________________________________________________________________
+
+def backtest_figure(data_set, title, regions):
+	"""
+	"""
+	time = np.array(rawdata[data_set].get_time())
+	confirmed, recovered, deaths, active, intensive = rawdata[data_set].get_data_for_regions(regions)
+	days = np.array([(t-time[-1]).days for t in time])
+	cutoffs, errors = backtest_logistic(days, confirmed, deaths, recovered, future=future,
+	                                    start=args.backtest_start, step=args.backtest_step)
+	# mean absolute and mean relative error of each horizon (horizons x [C, D, R])
+	with np.errstate(invalid='ignore'):
+		mape = np.nanmean(np.abs(errors), axis=0) if len(cutoffs) > 0 else np.full((future, 3), np.nan)
+		bias = np.nanmean(       errors , axis=0) if len(cutoffs) > 0 else np.full((future, 3), np.nan)
+	return len(cutoffs), mape, bias
+
+def backtest_figure_item(item):
+	"""
+	"""
+	data_set, title, regions = item
+	with pf.figure('%s:%s' %(data_set, title)):
+		result = backtest_figure(*item)
+	return (data_set, title) + result, pf.take()
+
+def backtest(figures):
+	"""
+	"""
+	# cut-offs of each figure in sequence (warm starts), figures in parallel
+	if (args.jobs > 1) and ('fork' in mp.get_all_start_methods()):
+		with mp.get_context('fork').Pool(args.jobs, initializer=pf.reset) as pool:
+			results = list(pool.imap(backtest_figure_item, figures))
+	else:
+		results = list(map(backtest_figure_item, figures))
+	# table of the mean absolute errors for the next day and the last projected day
+	print('')
+	print('%-30s | cut-offs | confirmed [%%]  | deaths [%%]     | recovered [%%]' %('figure'))
+	print('%-30s |          | %+3dd    %+3dd  | %+3dd    %+3dd  | %+3dd    %+3dd'
+	      %('', 1, future, 1, future, 1, future))
+	print('-'*31 + '+' + '-'*10 + ('+' + '-'*16)*3)
+	rows = []
+	for (data_set, title, ncutoffs, mape, bias), timings in results:
+		pf.merge(timings)
+		print('%-30s | %8d | %s' %(('%s:%s' %(data_set, title))[:30], ncutoffs,
+		      ' | '.join(['%6.2f %7.2f' %(mape[0, k]*100, mape[-1, k]*100) for k in range(3)])))
+		for h in range(future):
+			for k, metric in enumerate(['confirmed', 'deaths', 'recovered']):
+				rows.append([data_set, title, metric, h+1, ncutoffs, mape[h, k], bias[h, k]])
+	# all horizons
+	filename = os.path.join('figs', 'backtest.csv')
+	with open(filename, 'w') as f:
+		f.write('data_set,figure,metric,horizon,cutoffs,mape,bias\n')
+		for row in rows: f.write('%s,"%s",%s,%d,%d,%.6g,%.6g\n' %tuple(row))
+	print('')
+	print('errors of all horizons in %s' %(filename))
+
+# forecast errors instead of figures
+if args.backtest:
+	backtest([(data_set, title, regions) for data_set in data_sets
+	                                     for title, regions in ds[data_set].figures.items()])
+	if pf.is_enabled(): pf.write()
+	sys.exit()
+
+
+# animation_____________________________________________________________________
+
+def running_peaks(data):
+	"""
+	"""
+	# day of the maximum up to each day (first one, as np.argmax)
+	data = np.asarray(data)
+	new  = np.append(True, data[1:] > np.maximum.accumulate(data)[:-1])
+	return np.maximum.accumulate(np.where(new, np.arange(len(data)), 0))
+
+def animate_figure(data_set, title, regions):
+	"""
+	"""
+	# get time-series (complete)
+	time = np.array(rawdata[data_set].get_time())
+	confirmed, recovered, deaths, active, intensive = [np.array(data) for data in
+		rawdata[data_set].get_data_for_regions(regions)]
+	new    = rawdata[data_set].get_derived_for_regions('increments', regions)[:, rd.metrics.index('confirmed')]
+	growth = rawdata[data_set].get_derived_for_regions('growth', regions)
+	peaks  = [running_peaks(data) for data in [active, intensive, new]]
+	days   = np.array([(t-time[-1]).days for t in time])
+	x      = mdt.date2num(time)
+	cases  = np.flatnonzero(confirmed > 0)
+	first  = min((cases[0] if len(cases) > 0 else 0) + animation_days, len(time)) - 1
+
+	# figure of the whole period (fixed axes, as the figure of the last day)
+	psig, _, _ = get_fit(data_set, regions, time, confirmed, deaths, recovered)
+	art = init_figure(time)
+	fig, ax, axt = art['fig'], art['ax'], art['axt']
+	canvas = fig.canvas
+	ax.set_axisbelow(True) # bars drawn later stay above the grid
+	for h in art['bands']: h.set_verts([])
+	date = ax.text(1., 1.01, '', ha='right', transform=ax.transAxes)
+	ax.set_title(labels['title'] %(title, 0))
+	set_axes(art, time, int(np.min(days)), max(confirmed[-1], psig[0], 1.))
+
+	# bars of all days (those after the first frame drawn one by one)
+	update_bars(art['bars'][0],  active)
+	update_bars(art['bars'][1],  intensive)
+	update_bars(art['bars'][2], -deaths)
+	update_bars(art['bars'][3], -recovered, bottoms=-deaths)
+	for bars in art['bars']:
+		for rect in bars[first+1:]: rect.set_animated(True)
+
+	# artists changing at each frame (drawn on top of the background)
+	changing = [art['zero'], art['new']] + art['proj'] + art['peaks'] + art['peak_texts'] + \
+	           art['legends'] + [axt.yaxis, ax.title, date]
+	for h in changing: h.set_animated(True)
+
+	# background: everything but the changing artists
+	with pf.stage('render'):
+		canvas.draw()
+		background = canvas.copy_from_bbox(fig.bbox)
+	height, width = np.asarray(canvas.buffer_rgba()).shape[:2]
+
+	# one frame for each day, from the fit of the previous day
+	name = figure_name('animation', data_set, title)
+	filename = os.path.join('figs', '%s.%s' %(name, args.animate))
+	with FrameWriter(filename, width, height, fps=args.fps) as writer:
+		fits = fit_logistic_sequence(days, confirmed, deaths, recovered, range(first, len(time)), future)
+		for k, psig in fits:
+			with pf.stage('render'):
+				# add the bars of the day to the background
+				canvas.restore_region(background)
+				if k > first:
+					for bars in art['bars']: fig.draw_artist(bars[k])
+					background = canvas.copy_from_bbox(fig.bbox)
+
+				# new cases and projections (days counted from the day of the frame)
+				art['new'].set_data(x[:k+1], new[:k+1])
+				# (whole period while the fit has no more than one case)
+				past = days[0] - days[k]
+				if psig[0] > 1.: past = np.max([past, psig[2] - psig[1]*np.log(psig[0]/1.-1.)])
+				dayse = np.arange(int(past), int(future)+1)
+				for h, curve in zip(art['proj'], projections(dayse, psig)):
+					h.set_data(x[k]+dayse, curve)
+
+				# daily variations, peaks and values of the day
+				Dday = dict(zip(rd.metrics, growth[k]))
+				for h, metric in zip(art['days'], ['active', 'intensive', 'deaths', 'recovered']):
+					h.set_text(r'$%+.1f\%%$/day' %(Dday[metric]*100))
+				for hm, tm, data, iM in zip(art['peaks'], art['peak_texts'], [active, intensive, new],
+				                            [p[k] for p in peaks]):
+					hm.set_data([x[iM]], [data[iM]])
+					tm.set_position((x[iM], data[iM]))
+					tm.set_text(labels['peak'] %(data[iM]))
+				total = float(max(confirmed[k], 1))
+				axt.set_yticks([active[k], new[k], -deaths[k], -recovered[k]-deaths[k]])
+				axt.set_yticklabels([labels['final'] %(value, value/total*100)
+				                     for value in [active[k], new[k], deaths[k], recovered[k]]])
+				axt.set_ylim(ax.get_ylim())
+				ax.set_title(labels['title'] %(title, confirmed[k]))
+				date.set_text(str(time[k].date()))
+
+				# draw them and write the frame
+				for h in changing: fig.draw_artist(h)
+				writer.write(canvas.buffer_rgba())
+	plt.close(fig)
+	return writer.filename, writer.count
+
+def animate_figure_item(item):
+	"""
+	"""
+	data_set, title, regions = item
+	with pf.figure('%s:%s' %(data_set, title)):
+		result = animate_figure(*item)
+	return result, pf.take()
+
+def animate(figures):
+	"""
+	"""
+	# frames of each figure in sequence (warm starts), figures in parallel
+	if (args.jobs > 1) and ('fork' in mp.get_all_start_methods()):
+		with mp.get_context('fork').Pool(args.jobs, initializer=pf.reset) as pool:
+			results = list(pool.imap(animate_figure_item, figures))
+	else:
+		results = list(map(animate_figure_item, figures))
+	for (filename, count), timings in results:
+		pf.merge(timings)
+		print('%s (%d frames)' %(filename, count))
+
+# animations instead of figures
+if not(args.animate is None):
+	animate([(data_set, title, regions) for data_set in data_sets
+	                                    for title, regions in ds[data_set].figures.items()])
+	if pf.is_enabled(): pf.write()
+	sys.exit()
 
 
-	# save figure_______________________________________________________________
+# loop__________________________________________________________________________
 
-	if not(os.path.isdir('figs')): os.mkdir('figs')
-	fig.savefig(os.path.join('figs', 'histogram_%s.pdf' %(title)))
-	fig.savefig(os.path.join('figs', 'histogram_%s.png' %(title)))
+def collect(results):
+	"""
+	"""
+	for (log, (data_set, fit_key, fit_entry), (name, fig_hash)), timings in results:
+		pf.merge(timings)
+		print(log)
+		fits[data_set].entries[fit_key] = fit_entry
+		manifest[name] = fig_hash
+
+# figures of all data-sets
+figures = [(data_set, title, regions) for data_set in data_sets
+                                      for title, regions in ds[data_set].figures.items()]
+
+# figures in parallel (forked workers share the raw data read-only)
+if (args.jobs > 1) and ('fork' in mp.get_all_start_methods()):
+	with mp.get_context('fork').Pool(args.jobs, initializer=pf.reset) as pool:
+		collect(pool.imap(plot_figure_item, figures))
+else:
+	collect(map(plot_figure_item, figures))
+
+# store fits and rendered figures for the next run
+for data_set in data_sets: fits[data_set].save()
+with open(manifest_file + '.tmp', 'w') as f: json.dump(manifest, f)
+os.replace(manifest_file + '.tmp', manifest_file)
+
+# stage timings
+if pf.is_enabled(): pf.write()